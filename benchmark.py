@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import polars as pl
+import websockets
+
+import websocket_multiuser_process_5 as server
+
+
+def make_frame(rows: int, version: int):
+    """Fake producer output: a few numeric columns that change every version"""
+    return pl.DataFrame({
+        "id": list(range(rows)),
+        "price": [(i * 7 + version) % 1000 / 10 for i in range(rows)],
+        "qty": [(i + version) % 50 for i in range(rows)],
+        "pnl": [((i * 13 + version * 3) % 2000 - 1000) / 7 for i in range(rows)],
+    })
+
+
+def produce(file_name: str, file_folder: str, rows: int, interval: float):
+    """Stand-in for main.py: rewrite the CSV with a new version every interval
+
+    Each version carries its write time so clients can measure end-to-end frame latency.
+    """
+    version = 0
+    path = os.path.join(file_folder, file_name)
+    while True:
+        df = make_frame(rows, version).with_columns(pl.lit(time.time()).alias("written_at"))
+        df.write_csv(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        version += 1
+        time.sleep(interval)
+
+
+def report(name: str, samples: list):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<32} median {statistics.median(samples) * 1000:8.3f} ms   p95 {p95 * 1000:8.3f} ms")
+
+
+async def wait_until(condition, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step timed out")
+        await asyncio.sleep(0.0005)
+
+
+async def bench_producers(args):
+    """Compare startup time and per-update cost of subprocess and in-process producers"""
+    folder = tempfile.mkdtemp(prefix="bench-producers-")
+    server.PRODUCER_COMMAND = [sys.executable, os.path.abspath(__file__), "produce", "--rows", str(args.rows), "--"]
+
+    @server.producers.register("bench")
+    async def bench_producer(file_name, file_folder, publish):
+        version = 0
+        while True:
+            await publish(make_frame(args.rows, version))
+            version += 1
+            await asyncio.sleep(1)
+
+    subprocess_startup, inprocess_startup = [], []
+    for run in range(args.runs):
+        file_name = f"sub-{run}.csv"
+        started = time.perf_counter()
+        await server.process_manager.start_process(f"sub-{run}", file_name, folder)
+        await wait_until(lambda: os.path.exists(os.path.join(folder, file_name)))
+        subprocess_startup.append(time.perf_counter() - started)
+        await server.process_manager.stop_process(f"sub-{run}")
+
+        started = time.perf_counter()
+        await server.process_manager.start_process(f"inp-{run}", f"inp-{run}.csv", folder, producer="bench")
+        await wait_until(lambda: f"inp-{run}" in server.broadcaster.latest)
+        inprocess_startup.append(time.perf_counter() - started)
+        await server.process_manager.stop_process(f"inp-{run}")
+
+    # Per update: the subprocess path writes and re-parses a CSV, the in-process path only encodes
+    path = os.path.join(folder, "update.csv")
+    subprocess_update, inprocess_update = [], []
+    for version in range(args.updates):
+        df = make_frame(args.rows, version)
+        started = time.perf_counter()
+        df.write_csv(path)
+        server.parse_file_data(path)
+        subprocess_update.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        server.encode_frame(server.clean_frame(df))
+        inprocess_update.append(time.perf_counter() - started)
+
+    print(f"producers: {args.runs} starts, {args.updates} updates of {args.rows} rows")
+    report("subprocess startup", subprocess_startup)
+    report("in-process startup", inprocess_startup)
+    report("subprocess per update", subprocess_update)
+    report("in-process per update", inprocess_update)
+
+
+def start_server(profile: str, port: int, folder: str, args):
+    """Run the server in a subprocess with the given runtime profile and fake producers"""
+    env = dict(
+        os.environ,
+        RUNTIME_PROFILE=profile,
+        SERVER_PORT=str(port),
+        FILE_FOLDER=folder,
+        WATCH_INTERVAL=str(args.watch_interval),
+        CHECKPOINT_DIR=os.path.join(folder, ".checkpoint"),
+        PRODUCER_COMMAND=f"{sys.executable} {os.path.abspath(__file__)} produce --rows {args.rows} --interval {args.interval} --",
+        MAX_PRODUCERS_PER_CLIENT=str(args.files),
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(server.__file__)], env=env, cwd=folder,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise TimeoutError(f"{profile} server did not start")
+
+
+async def client(uri: str, key: int, ready: list, latencies: list, stop: asyncio.Event):
+    """One dashboard connection: subscribe to a file and time every update it receives"""
+    started = time.perf_counter()
+    async with websockets.connect(uri, max_size=None, open_timeout=30) as ws:
+        await ws.send(json.dumps({"req_from_id": "bench", "req_to_id": str(key)}))
+        first = True
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            received = time.time()
+            written_at = json.loads(message).get("written_at")
+            if not written_at:
+                continue
+            if first:
+                ready.append(time.perf_counter() - started)
+                first = False
+            else:
+                latencies.append(received - written_at[0])
+
+
+async def measure_runtime(port: int, args) -> dict:
+    uri = f"ws://127.0.0.1:{port}/ws"
+    ready, latencies = [], []
+    stop = asyncio.Event()
+    tasks = [
+        asyncio.create_task(client(uri, number % args.files, ready, latencies, stop))
+        for number in range(args.connections)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "ready": ready,
+        "latencies": latencies,
+        "failed": sum(isinstance(result, Exception) for result in results),
+    }
+
+
+def bench_runtime(args):
+    """Compare connection capacity and frame latency of the runtime profiles"""
+    print(f"runtime: {args.connections} connections over {args.files} files of {args.rows} rows, "
+          f"an update every {args.interval}s for {args.duration}s")
+    for number, profile in enumerate(args.profiles.split(",")):
+        # A fresh folder per profile, so the first frame has to wait for its own producers
+        folder = tempfile.mkdtemp(prefix=f"bench-runtime-{profile}-")
+        process = start_server(profile, args.port + number, folder, args)
+        try:
+            result = asyncio.run(measure_runtime(args.port + number, args))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        print(f"{profile}: {len(result['ready'])}/{args.connections} connections streaming, {result['failed']} failed")
+        if result["ready"]:
+            report(f"{profile} time to first frame", result["ready"])
+        if result["latencies"]:
+            report(f"{profile} frame latency", result["latencies"])
+
+
+async def subscribe_timings(uri: str, key: int, timeout: float = 30) -> dict:
+    """Time one new subscriber: first byte, first data, and first data written after it subscribed"""
+    timings = {}
+    async with websockets.connect(uri, max_size=None, open_timeout=timeout) as ws:
+        started = time.perf_counter()
+        subscribed_at = time.time()
+        await ws.send(json.dumps({"req_from_id": "bench", "req_to_id": str(key)}))
+        while "live" not in timings:
+            message = await asyncio.wait_for(ws.recv(), timeout=timeout)
+            elapsed = time.perf_counter() - started
+            timings.setdefault("byte", elapsed)
+            written_at = json.loads(message).get("written_at")
+            if written_at:
+                timings.setdefault("data", elapsed)
+                if written_at[0] >= subscribed_at:
+                    timings["live"] = elapsed
+    return timings
+
+
+async def measure_first_paint(port: int, args) -> list:
+    uri = f"ws://127.0.0.1:{port}/ws"
+    # Warm up: run each producer once so its last version is on disk and in the server's cache
+    for key in range(args.files):
+        await subscribe_timings(uri, key)
+    samples = []
+    for number in range(args.connections):
+        samples.append(await subscribe_timings(uri, number % args.files))
+    return samples
+
+
+def bench_first_paint(args):
+    """Time to first byte for a returning subscriber, against time to its first live update"""
+    folder = tempfile.mkdtemp(prefix="bench-first-paint-")
+    process = start_server(args.profile, args.port, folder, args)
+    try:
+        samples = asyncio.run(measure_first_paint(args.port, args))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    print(f"first paint: {args.connections} subscriptions to {args.files} files of {args.rows} rows "
+          f"whose producers last ran earlier, an update every {args.interval}s")
+    report("time to first byte", [sample["byte"] for sample in samples])
+    report("time to first data", [sample["data"] for sample in samples])
+    report("time to first live update", [sample["live"] for sample in samples])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the websocket streaming server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    producers = commands.add_parser("producers", help="subprocess vs in-process producer cost")
+    producers.add_argument("--runs", type=int, default=5)
+    producers.add_argument("--updates", type=int, default=50)
+    producers.add_argument("--rows", type=int, default=5000)
+
+    runtime = commands.add_parser("runtime", help="default vs fast runtime profile under many connections")
+    runtime.add_argument("--profiles", default="default,fast")
+    runtime.add_argument("--connections", type=int, default=200)
+    runtime.add_argument("--files", type=int, default=4)
+    runtime.add_argument("--rows", type=int, default=200)
+    runtime.add_argument("--interval", type=float, default=0.5)
+    runtime.add_argument("--duration", type=float, default=20)
+    runtime.add_argument("--watch-interval", type=float, default=0.05)
+    runtime.add_argument("--port", type=int, default=8100)
+
+    first_paint = commands.add_parser("first-paint", help="time to first byte for new subscribers")
+    first_paint.add_argument("--profile", default="default")
+    first_paint.add_argument("--connections", type=int, default=20)
+    first_paint.add_argument("--files", type=int, default=4)
+    first_paint.add_argument("--rows", type=int, default=200)
+    first_paint.add_argument("--interval", type=float, default=1)
+    first_paint.add_argument("--watch-interval", type=float, default=1)
+    first_paint.add_argument("--port", type=int, default=8100)
+
+    fake = commands.add_parser("produce", help="fake main.py used by the benchmarks")
+    fake.add_argument("--rows", type=int, default=5000)
+    fake.add_argument("--interval", type=float, default=1)
+    fake.add_argument("file_name")
+    fake.add_argument("file_folder")
+
+    args = parser.parse_args()
+    if args.command == "produce":
+        produce(args.file_name, args.file_folder, args.rows, args.interval)
+    elif args.command == "producers":
+        asyncio.run(bench_producers(args))
+    elif args.command == "runtime":
+        bench_runtime(args)
+    elif args.command == "first-paint":
+        bench_first_paint(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -140,6 +140,7 @@ class ConnectionManager:
         if process:
             print(f"Stopping process for {file_key} with PID: {process.pid}")
             process.kill()
+            process.wait()  # Reap it so it does not linger as a zombie
             self.active_processes[file_key]['process'] = None
         del self.active_processes[file_key]
 
@@ -1,5 +1,7 @@
 import os
 import asyncio
+import json
+import hashlib
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 
@@ -26,28 +28,128 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
-async def send_file_data(websocket: WebSocket, file_path: str):
-    while True:
-        if websocket not in manager.active_connections:
-            break
+# How often watched files are stat()ed, and the size of each binary frame
+POLL_INTERVAL = float(os.environ.get("FILE_POLL_INTERVAL", 1))
+CHUNK_SIZE = int(os.environ.get("FILE_CHUNK_SIZE", 64 * 1024))
+
+
+class FileStreamer:
+    """Class to watch one file and stream its changes to every viewer with a single read"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.viewers = set()
+        self.stat = None
+        # Hash of the content viewers already have, to tell a real append from an in-place rewrite
+        self.sent_digest = None
+        self.task = None
+        # Keeps one viewer's initial send from interleaving with a change broadcast
+        self.lock = asyncio.Lock()
+
+    async def add_viewer(self, websocket: WebSocket):
+        """Send the current file to a new viewer and start watching if needed"""
+        async with self.lock:
+            self.viewers.add(websocket)
+            if self.stat is None:
+                self.stat = os.stat(self.file_path)
+                self.sent_digest = await asyncio.to_thread(self.digest, self.stat.st_size)
+            await self.send_range({websocket}, "full", 0, self.stat.st_size)
+        if self.task is None:
+            self.task = asyncio.create_task(self.watch())
+
+    def remove_viewer(self, websocket: WebSocket):
+        """Forget a viewer; returns True once nobody is watching"""
+        self.viewers.discard(websocket)
+        if not self.viewers and self.task:
+            self.task.cancel()
+            self.task = None
+        return not self.viewers
+
+    async def watch(self):
+        while self.viewers:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                stat = os.stat(self.file_path)
+            except FileNotFoundError:
+                continue
+            async with self.lock:
+                previous, self.stat = self.stat, stat
+                if (stat.st_mtime_ns, stat.st_size, stat.st_ino) == (previous.st_mtime_ns, previous.st_size, previous.st_ino):
+                    continue
+                appended = (
+                    stat.st_ino == previous.st_ino and stat.st_size > previous.st_size
+                    and await asyncio.to_thread(self.digest, previous.st_size) == self.sent_digest
+                )
+                if appended:
+                    # Grown in place with the old bytes untouched: only the tail is new
+                    await self.send_range(set(self.viewers), "append", previous.st_size, stat.st_size)
+                else:
+                    await self.send_range(set(self.viewers), "full", 0, stat.st_size)
+                self.sent_digest = await asyncio.to_thread(self.digest, stat.st_size)
+
+    def digest(self, end: int) -> bytes:
+        """SHA-1 of the file's first end bytes"""
+        digest = hashlib.sha1()
+        fd = os.open(self.file_path, os.O_RDONLY)
         try:
-            with open(file_path, 'r') as file:
-                data = file.read()
-            await manager.send_personal_message(data, websocket)
-            await asyncio.sleep(10)
-        except Exception as e:
-            print(f"Error reading file {file_path}: {e}")
-            break
+            for offset in range(0, end, CHUNK_SIZE):
+                chunk = os.pread(fd, min(CHUNK_SIZE, end - offset), offset)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            os.close(fd)
+        return digest.digest()
+
+    async def send_range(self, viewers: set, kind: str, start: int, end: int):
+        """Send bytes [start, end) as a header frame followed by fixed-size binary chunks"""
+        header = json.dumps({"type": kind, "offset": start, "size": end - start})
+        await self.broadcast(viewers, header)
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            for offset in range(start, end, CHUNK_SIZE):
+                chunk = await asyncio.to_thread(os.pread, fd, min(CHUNK_SIZE, end - offset), offset)
+                if not chunk:
+                    break
+                await self.broadcast(viewers, chunk)
+        finally:
+            os.close(fd)
+
+    async def broadcast(self, viewers: set, data):
+        for websocket in viewers:
+            if websocket not in self.viewers:
+                continue
+            try:
+                if isinstance(data, bytes):
+                    await websocket.send_bytes(data)
+                else:
+                    await websocket.send_text(data)
+            except Exception as e:
+                print(f"Error sending {self.file_path}: {e}")
+                self.viewers.discard(websocket)
+
+
+streamers = {}
 
 @app.websocket("/ws/{file_name}")
 async def websocket_endpoint(websocket: WebSocket, file_name: str):
     await manager.connect(websocket)
     file_path = os.path.join('files', file_name)
+    streamer = streamers.get(file_path)
+    if streamer is None:
+        streamer = streamers[file_path] = FileStreamer(file_path)
     try:
-        await send_file_data(websocket, file_path)
+        await streamer.add_viewer(websocket)
+        while True:
+            # Nothing is expected from the client; this just waits for the disconnect
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
     finally:
+        if streamer.remove_viewer(websocket):
+            streamers.pop(file_path, None)
         manager.disconnect(websocket)
 
 @app.get("/")
@@ -64,11 +166,21 @@ async def get():
             <pre id="output"></pre>
             <script>
                 var ws;
+                var decoder = new TextDecoder();
                 function connectWebSocket() {
                     var fileName = document.getElementById("fileName").value;
+                    var output = document.getElementById("output");
                     ws = new WebSocket(`ws://127.0.0.1:8000/ws/${fileName}`);
+                    ws.binaryType = "arraybuffer";
                     ws.onmessage = function(event) {
-                        document.getElementById("output").textContent = event.data;
+                        if (typeof event.data === "string") {
+                            // Header frame: a full resend clears the view, an append keeps it
+                            if (JSON.parse(event.data).type === "full") {
+                                output.textContent = "";
+                            }
+                            return;
+                        }
+                        output.textContent += decoder.decode(event.data, {stream: true});
                     };
                     ws.onclose = function(event) {
                         alert("WebSocket connection closed");
@@ -2,6 +2,7 @@ import os
 import asyncio
 import subprocess
 import threading
+import time
 import polars as pl
 from polars.exceptions import ComputeError
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
@@ -11,6 +12,9 @@ from starlette.websockets import WebSocketState
 
 app = FastAPI()
 
+# Subscribe messages arriving inside this window collapse into the last one
+SUBSCRIBE_DEBOUNCE = float(os.environ.get("SUBSCRIBE_DEBOUNCE", 0.3))
+
 class UserSession:
     """Class to manage the process and data sending for each user"""
 
@@ -19,6 +23,42 @@ class UserSession:
         self.process = None
         self.thread = None
         self.thread_flag = False
+        self.subscription = None
+        self.pending = None
+        self.closed = False
+        # Restarts run in worker threads; the lock keeps a slow one from overlapping the next
+        self.restart_lock = asyncio.Lock()
+        self.loop = asyncio.get_running_loop()
+
+    async def subscribe(self, file_folder: str, file_name: str):
+        """Debounce a subscribe request; re-requesting the active file is a no-op"""
+        if self.pending:
+            self.pending.cancel()
+            self.pending = None
+        if (file_folder, file_name) == self.subscription:
+            print(f"Already streaming {file_name}, ignoring duplicate request")
+            return
+        self.pending = asyncio.create_task(self._subscribe_later(file_folder, file_name))
+
+    async def _subscribe_later(self, file_folder: str, file_name: str):
+        await asyncio.sleep(SUBSCRIBE_DEBOUNCE)
+        # Past the debounce the request is committed: a newer one queues behind it, not cancels it
+        self.pending = None
+        self.subscription = (file_folder, file_name)
+        async with self.restart_lock:
+            if self.closed or self.subscription != (file_folder, file_name):
+                # Disconnected, or superseded by a request that will restart anyway
+                return
+            # Restarting joins the old sender thread, keep that off the event loop
+            await asyncio.to_thread(self.restart, file_name, file_folder)
+            if self.closed:
+                # Disconnected while restarting: stop what the restart just started
+                await asyncio.to_thread(self.stop)
+
+    def restart(self, file_name: str, file_folder: str):
+        """Restart the subprocess and sender thread for a new file"""
+        self.start_process(file_name, file_folder)
+        self.start_thread(os.path.join(file_folder, file_name))
 
     def start_process(self, file_name: str, file_folder: str):
         """Start the subprocess"""
@@ -33,6 +73,7 @@ class UserSession:
         if self.process:
             print(f"Killing process with PID: {self.process.pid}")
             self.process.kill()
+            self.process.wait()  # Reap it so it does not linger as a zombie
             self.process = None
 
     def start_thread(self, file_path: str):
@@ -94,11 +135,19 @@ class UserSession:
             print(f"Exception while sending data: {e}")
             self.disconnect()
 
-    def disconnect(self):
-        """Clean up on disconnect"""
+    def stop(self):
         self.stop_thread()
         self.kill_process()
 
+    def disconnect(self):
+        """Clean up on disconnect"""
+        self.closed = True
+        if self.pending:
+            # Also called from the sender thread, while the task belongs to the event loop
+            self.loop.call_soon_threadsafe(self.pending.cancel)
+            self.pending = None
+        self.stop()
+
 
 class ConnectionManager:
     """Class defining socket events"""
@@ -135,9 +184,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 await user_session.send_personal_message(json.dumps({"error": "Missing fileFolder or fileName in received data"}))
                 continue
 
-            file_path = os.path.join(file_folder, file_name)
-            user_session.start_process(file_name, file_folder)
-            user_session.start_thread(file_path)
+            await user_session.subscribe(file_folder, file_name)
     except WebSocketDisconnect:
         print("WebSocket disconnect detected")
     finally:
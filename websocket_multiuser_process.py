@@ -124,6 +124,7 @@ class ConnectionManager:
             process = self.processes[file_key]
             print(f"Stopping process with PID: {process.pid} for {file_key}")
             process.kill()
+            process.wait()  # Reap it so it does not linger as a zombie
             del self.processes[file_key]
             del self.reference_counts[file_key]
 
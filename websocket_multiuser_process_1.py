@@ -37,6 +37,7 @@ class ProcessManager:
                 process = self.processes[process_key]["process"]
                 print(f"Killing process {process_key} with PID: {process.pid}")
                 process.kill()
+                process.wait()  # Reap it so it does not linger as a zombie
                 del self.processes[process_key]
 
     def add_session(self, process_key: str, session: 'UserSession'):
@@ -14,6 +14,9 @@ from starlette.websockets import WebSocketState
 
 app = FastAPI()
 
+# Repeated subscribe messages for the same key inside this window collapse into one
+SUBSCRIBE_DEBOUNCE = float(os.environ.get("SUBSCRIBE_DEBOUNCE", 0.3))
+
 class ProcessManager:
     """Class to manage processes and associated user sessions"""
 
@@ -40,6 +43,7 @@ class ProcessManager:
                     process = self.processes[process_key]["process"]
                     print(f"Killing process {process_key} with PID: {process.pid}")
                     process.kill()
+                    process.wait()  # Reap it so it does not linger as a zombie
                     del self.processes[process_key]
 
     async def add_session(self, process_key: str, session: 'UserSession'):
@@ -140,11 +144,46 @@ class ConnectionManager:
 
     def __init__(self):
         self.active_connections = defaultdict(set)
+        self.pending = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
 
+    def get_session(self, websocket: WebSocket, process_key: str):
+        """Return the session already streaming process_key to this socket, if any"""
+        for session in self.active_connections.get(process_key, ()):
+            if session.websocket == websocket:
+                return session
+        return None
+
+    def subscribe(self, websocket: WebSocket, process_key: str, file_name: str, file_path: str):
+        """Debounce a subscribe request; an identical active subscription is a no-op"""
+        pending = self.pending.pop((websocket, process_key), None)
+        if pending:
+            pending.cancel()
+        if self.get_session(websocket, process_key) is not None:
+            print(f"Already subscribed to {process_key}, ignoring duplicate request")
+            return
+        self.pending[(websocket, process_key)] = asyncio.create_task(
+            self._subscribe_later(websocket, process_key, file_name, file_path)
+        )
+
+    async def _subscribe_later(self, websocket: WebSocket, process_key: str, file_name: str, file_path: str):
+        await asyncio.sleep(SUBSCRIBE_DEBOUNCE)
+        self.pending.pop((websocket, process_key), None)
+        if websocket.client_state != WebSocketState.CONNECTED:
+            return
+
+        user_session = UserSession(websocket, process_key)
+        self.active_connections[process_key].add(user_session)
+
+        await process_manager.start_process(process_key, file_name, "path_to_your_files")
+        await process_manager.add_session(process_key, user_session)
+        user_session.start_thread(file_path)
+
     async def disconnect(self, websocket: WebSocket):
+        for key in [key for key in self.pending if key[0] == websocket]:
+            self.pending.pop(key).cancel()
         for process_key, sessions in self.active_connections.items():
             for session in sessions:
                 if session.websocket == websocket:
@@ -176,12 +215,7 @@ async def websocket_endpoint(websocket: WebSocket):
             file_name = f"{req_from_id}-{req_to_id}.csv"
             file_path = os.path.join("path_to_your_files", file_name)  # Replace "path_to_your_files" with the actual path
 
-            user_session = UserSession(websocket, process_key)
-            manager.active_connections[process_key].add(user_session)
-
-            await process_manager.start_process(process_key, file_name, "path_to_your_files")
-            await process_manager.add_session(process_key, user_session)
-            user_session.start_thread(file_path)
+            manager.subscribe(websocket, process_key, file_name, file_path)
     except WebSocketDisconnect:
         print("WebSocket disconnect detected")
     finally:
@@ -1,42 +1,1649 @@
 import os
 import asyncio
-import subprocess
 import threading
 import time
 import json
-from collections import defaultdict
+import math
+import glob
+import resource
+import fnmatch
+import re
+import shlex
+import signal
+import functools
+import hashlib
+import struct
+import bisect
+import mmap
+import queue
+import random
+import sys
+import secrets
+import tracemalloc
+import importlib.util
+import weakref
+import logging
+from logging.handlers import RotatingFileHandler
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from importlib.metadata import entry_points
 
 import polars as pl
-from polars.exceptions import ComputeError
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from polars.exceptions import ComputeError, NoDataError
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from starlette.websockets import WebSocketState
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop the background workers that live as long as the server"""
+    producers.load_entry_points()
+    await checkpointer.restore()
+    stats_task = asyncio.create_task(resource_sampler.run())
+    yield
+    stats_task.cancel()
+    # A no-op if DrainingServer already drained before uvicorn closed the sockets
+    await drain_server()
+
+
+async def drain_server(timeout: float = None):
+    """Stop taking subscriptions, move clients elsewhere, checkpoint, then stop producers"""
+    if manager.draining:
+        return
+    manager.draining = True
+    process_manager.draining = True
+    deadline = time.monotonic() + (DRAIN_TIMEOUT if timeout is None else timeout)
+    websockets = manager.websockets()
+    print(f"Draining {len(websockets)} connections and {len(process_manager.processes)} producers")
+
+    async def notify(websocket: WebSocket):
+        try:
+            if websocket.client_state == WebSocketState.CONNECTED:
+                await manager.outbox(websocket).flush()
+                await websocket.send_text(RECONNECT_FRAME)
+                await websocket.close(code=1012)
+        except Exception as e:
+            print(f"Error notifying client during drain: {e}")
+
+    try:
+        # Let in-flight parses finish so their frames go out before the sockets close
+        await asyncio.wait_for(
+            asyncio.gather(*parse_pool.inflight.values(), return_exceptions=True),
+            max(deadline - time.monotonic(), 0)
+        )
+        await asyncio.wait_for(
+            asyncio.gather(*(notify(websocket) for websocket in websockets)),
+            max(deadline - time.monotonic(), 0)
+        )
+    except asyncio.TimeoutError:
+        print("Drain deadline reached while flushing clients")
+    await checkpointer.save()
+    await process_manager.stop_all(deadline - time.monotonic())
+    if recorder:
+        recorder.close()
+    if sidecars:
+        sidecars.close()
+    tracer.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Parsing runs off the event loop; polars releases the GIL while reading, so threads scale with cores
+PARSE_POOL_SIZE = int(os.environ.get("PARSE_POOL_SIZE", min(32, (os.cpu_count() or 1) + 4)))
+
+
+# Folder the producers write into, and how often each watched folder is rescanned
+FILE_FOLDER = os.environ.get("FILE_FOLDER", "path_to_your_files")
+WATCH_INTERVAL = float(os.environ.get("WATCH_INTERVAL", 1))
+
+# Command used to spawn a subprocess producer; file name and folder are appended
+PRODUCER_COMMAND = shlex.split(os.environ.get("PRODUCER_COMMAND", "python main.py"))
+# Packages can expose in-process producers under this entry point group
+PRODUCER_ENTRY_POINT_GROUP = "websocket_project.producers"
+
+# Admission control for main.py producers; limits of 0 mean unlimited
+MAX_PRODUCERS = int(os.environ.get("MAX_PRODUCERS", 4 * (os.cpu_count() or 1)))
+MAX_PRODUCERS_PER_CLIENT = int(os.environ.get("MAX_PRODUCERS_PER_CLIENT", 8))
+PRODUCER_MAX_MEMORY = int(os.environ.get("PRODUCER_MAX_MEMORY", 2 * 1024 ** 3))
+PRODUCER_MAX_CPU_SECONDS = int(os.environ.get("PRODUCER_MAX_CPU_SECONDS", 0))
+# Seconds a producer gets to exit after SIGTERM before it is sent SIGKILL
+PRODUCER_STOP_TIMEOUT = float(os.environ.get("PRODUCER_STOP_TIMEOUT", 5))
+
+# Producer stdout/stderr is kept in memory; set PRODUCER_LOG_DIR to also write rotated per-producer files
+PRODUCER_LOG_LINES = int(os.environ.get("PRODUCER_LOG_LINES", 1000))
+PRODUCER_LOG_DIR = os.environ.get("PRODUCER_LOG_DIR")
+PRODUCER_LOG_MAX_BYTES = int(os.environ.get("PRODUCER_LOG_MAX_BYTES", 10 * 1024 ** 2))
+PRODUCER_LOG_BACKUPS = int(os.environ.get("PRODUCER_LOG_BACKUPS", 3))
+
+# How often the admin stats snapshot (producer /proc usage, session counters) is refreshed
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", 5))
+
+# Active producers and the latest parsed snapshots are saved here on shutdown and restored
+# on start; restored producers nobody re-subscribes to are stopped after the grace period
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", ".checkpoint")
+RESTORE_GRACE = float(os.environ.get("RESTORE_GRACE", 60))
+
+# Seconds allowed for the shutdown drain: notify clients, flush, checkpoint, stop producers
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 15))
+
+# A read that races the producer is retried this many times, with doubling backoff, before
+# falling back to the last good version. Producers should write "<name>.tmp" and rename it
+# over the real file; names with these suffixes are never read or reported by the watcher.
+TORN_READ_RETRIES = int(os.environ.get("TORN_READ_RETRIES", 3))
+TORN_READ_BACKOFF = float(os.environ.get("TORN_READ_BACKOFF", 0.05))
+TEMP_FILE_SUFFIXES = (".tmp", ".part", "~")
+
+# Every parsed version is also written as an uncompressed Arrow IPC sidecar by a background
+# worker. Reloading an evicted version, or one parsed by another worker or before a restart,
+# then memory-maps the columnar copy instead of parsing CSV. Sidecars older than
+# SIDECAR_MAX_AGE seconds, or beyond SIDECAR_BUDGET bytes (oldest first), are deleted.
+# An empty SIDECAR_DIR turns sidecars off.
+SIDECAR_DIR = os.environ.get("SIDECAR_DIR", ".sidecars")
+SIDECAR_MAX_AGE = float(os.environ.get("SIDECAR_MAX_AGE", 3600))
+SIDECAR_BUDGET = int(os.environ.get("SIDECAR_BUDGET", 1024 ** 3))
+
+# Comma-separated globs of append-only ("tail mode") files: a new version only hashes the
+# rows added since the last one, as long as the old first and last rows are unchanged
+TAIL_FILES = [pattern for pattern in os.environ.get("TAIL_FILES", "").split(",") if pattern]
+
+# Parsed DataFrames are shared process-wide up to this many (estimated) bytes; files with
+# active subscribers are pinned and never evicted
+FRAME_CACHE_BYTES = int(os.environ.get("FRAME_CACHE_BYTES", 512 * 1024 ** 2))
+
+# Set RECORD_DIR to append every published version to a per-key log for replay; a full
+# keyframe is written every RECORD_KEYFRAME_EVERY versions, deltas in between
+RECORD_DIR = os.environ.get("RECORD_DIR")
+RECORD_KEYFRAME_EVERY = int(os.environ.get("RECORD_KEYFRAME_EVERY", 50))
+
+# Fraction of updates traced end to end (0 disables tracing); spans go to a local JSONL file
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+
+# Bearer token for the /admin routes. Without one they only answer local clients, and the
+# profiler stays disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+
+# "default" is plain uvicorn. "fast" uses uvloop and httptools (when installed), a small
+# inbound message limit, quicker pings, no per-message compression and SERVER_WORKERS
+# processes. Workers share nothing: each runs its own producers, caches and producer limits,
+# so clients of one key on different workers start one producer each. More than one worker
+# is refused while checkpoints, sidecars, recording or tracing are on, as every worker would
+# write the same files.
+RUNTIME_PROFILE = os.environ.get("RUNTIME_PROFILE", "default")
+SERVER_HOST = os.environ.get("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 1))
+WS_MAX_SIZE = int(os.environ.get("WS_MAX_SIZE", 64 * 1024))
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", 10))
+WS_PING_TIMEOUT = float(os.environ.get("WS_PING_TIMEOUT", 10))
+
+# Frames bound for one connection within this many seconds go out as one {"type": "batch"}
+# message; 0 sends each frame as it is ready. Clients can pick their own window with
+# {"batch_ms": ...} up to MAX_BATCH_WINDOW.
+BATCH_WINDOW = float(os.environ.get("BATCH_WINDOW", 0))
+MAX_BATCH_WINDOW = float(os.environ.get("MAX_BATCH_WINDOW", 1))
+
+# Outbound quotas, 0 for unlimited: per connection and per user (client host), in bytes and
+# frames per second, with QUOTA_BURST seconds of headroom. A client over quota is not dropped:
+# it gets the newest version of each key once its buckets refill, skipping the ones between.
+CLIENT_BYTES_PER_SEC = int(os.environ.get("CLIENT_BYTES_PER_SEC", 0))
+CLIENT_FRAMES_PER_SEC = float(os.environ.get("CLIENT_FRAMES_PER_SEC", 0))
+USER_BYTES_PER_SEC = int(os.environ.get("USER_BYTES_PER_SEC", 0))
+USER_FRAMES_PER_SEC = float(os.environ.get("USER_FRAMES_PER_SEC", 0))
+QUOTA_BURST = float(os.environ.get("QUOTA_BURST", 1))
+
+# Row-stream ("ndjson") output sends this many records per frame
+NDJSON_BATCH_ROWS = int(os.environ.get("NDJSON_BATCH_ROWS", 1000))
+# "delta" output sends a snapshot and then only changed rows per session
+OUTPUT_FORMATS = ("columns", "ndjson", "delta")
+
+
+class Tracer:
+    """Class to sample per-update traces and export their spans to a local JSONL file
+
+    Each line is one span with OTLP field names (traceId, spanId, parentSpanId,
+    startTimeUnixNano, ...), written by a background thread so callers never block on disk.
+    """
+
+    def __init__(self, sample_rate: float, path: str):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def start(self, name: str, **attributes):
+        """Begin a trace, or return None for an unsampled update"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return Trace(self, name, attributes)
+
+    def export(self, span: dict):
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.write, name="trace-writer", daemon=True)
+                    self.writer.start()
+        self.queue.put(span)
+
+    def write(self):
+        with open(self.path, "a") as f:
+            while True:
+                span = self.queue.get()
+                if span is None:
+                    break
+                f.write(json.dumps(span) + "\n")
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        if self.writer:
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+            self.writer = None
+
+
+class Trace:
+    """One sampled update: a root span with a child span per pipeline stage"""
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        start_ns = time.time_ns()
+        try:
+            yield
+        finally:
+            self.export(os.urandom(8).hex(), self.span_id, name, start_ns, attributes)
+
+    def end(self):
+        self.export(self.span_id, None, self.name, self.start_ns, self.attributes)
+
+    def export(self, span_id: str, parent_span_id: str, name: str, start_ns: int, attributes: dict):
+        self.tracer.export({
+            "traceId": self.trace_id,
+            "spanId": span_id,
+            "parentSpanId": parent_span_id,
+            "name": name,
+            "startTimeUnixNano": start_ns,
+            "endTimeUnixNano": time.time_ns(),
+            "attributes": dict(attributes, thread=threading.current_thread().name),
+        })
+
+
+NO_SPAN = nullcontext()
+
+
+def span(trace, name: str, **attributes):
+    """Child span of trace, or a shared no-op context when the update is not sampled"""
+    return trace.span(name, **attributes) if trace else NO_SPAN
+
+
+class StackProfiler:
+    """Class to sample the stacks of every thread in the live process for a fixed time
+
+    Produces collapsed stacks ("thread;outer;inner count" per line), the input format of
+    flamegraph.pl and speedscope. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def run(self, seconds: float, interval: float, memory_top: int = 0):
+        """Blocking; call from a worker thread so the event loop keeps running and is sampled too"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        started_tracing = False
+        try:
+            if memory_top and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            stacks = defaultdict(int)
+            own = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[self.collapse(names.get(ident, str(ident)), frame)] += 1
+                samples += 1
+                time.sleep(interval)
+            result = {
+                "samples": samples,
+                "collapsed": "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items())),
+            }
+            if memory_top:
+                statistics = tracemalloc.take_snapshot().statistics("lineno")[:memory_top]
+                result["allocations"] = [
+                    {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+                    for stat in statistics
+                ]
+            return result
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self.lock.release()
+
+    @staticmethod
+    def collapse(thread_name: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            name = getattr(code, "co_qualname", code.co_name)
+            names.append(f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        names.append(thread_name)
+        return ";".join(reversed(names))
+
+
+def runtime_options(profile: str) -> dict:
+    """uvicorn.Config keyword arguments for a RUNTIME_PROFILE"""
+    if profile == "default":
+        return {}
+    if profile != "fast":
+        raise ValueError(f"Unknown RUNTIME_PROFILE {profile}, expected 'default' or 'fast'")
+    if SERVER_WORKERS > 1:
+        shared = [
+            name for name, value in (("CHECKPOINT_DIR", CHECKPOINT_DIR), ("SIDECAR_DIR", SIDECAR_DIR),
+                                     ("RECORD_DIR", RECORD_DIR), ("TRACE_SAMPLE_RATE", TRACE_SAMPLE_RATE))
+            if value
+        ]
+        if shared:
+            raise ValueError(f"SERVER_WORKERS={SERVER_WORKERS} would share the files of {', '.join(shared)}; set them empty or use one worker")
+    options = {
+        "ws_max_size": WS_MAX_SIZE,
+        "ws_ping_interval": WS_PING_INTERVAL,
+        "ws_ping_timeout": WS_PING_TIMEOUT,
+        "ws_per_message_deflate": False,
+        "workers": SERVER_WORKERS,
+    }
+    for option, module in (("loop", "uvloop"), ("http", "httptools")):
+        if importlib.util.find_spec(module):
+            options[option] = module
+        else:
+            print(f"{module} is not installed, using uvicorn's default {option}")
+    return options
+
+
+class TornReadError(Exception):
+    """The file was incomplete or changed while it was being read"""
+
+
+def read_file_frame(file_path: str, trace=None):
+    """Read a CSV file into a cleaned DataFrame, checking it did not change during the read
+
+    Returns (df, fingerprint); df is None if the file does not exist or has no rows.
+    """
+    before = file_fingerprint(file_path)
+    if before is None:
+        return None, None
+    if before[0] == 0:
+        # Truncated and not yet rewritten; even a header-only CSV has bytes
+        raise TornReadError(file_path)
+    try:
+        with span(trace, "parse", file=file_path):
+            df = pl.read_csv(file_path)
+    except (ComputeError, NoDataError) as e:
+        raise TornReadError(file_path) from e
+    if file_fingerprint(file_path) != before:
+        raise TornReadError(file_path)
+    with span(trace, "clean"):
+        return clean_frame(df), before
+
+
+def clean_frame(df):
+    """Replace NaN with None, or return None for an empty frame"""
+    if df is None or df.is_empty():
+        return None
+    # Done column-wise instead of a Python call per cell
+    return df.with_columns([
+        pl.col(column).fill_nan(None)
+        for column, dtype in df.schema.items() if dtype.is_float()
+    ])
+
+
+def encode_columns(df) -> list:
+    """Encode as a single column-oriented JSON frame"""
+    if df is None:
+        return [json.dumps({})]
+    return [json.dumps(df.to_dict(as_series=False))]
+
+
+def encode_ndjson(df) -> list:
+    """Encode as a header frame followed by batches of newline-delimited row records"""
+    if df is None:
+        return [json.dumps({"type": "ndjson", "columns": [], "rows": 0, "batches": 0})]
+    batches = [
+        df.slice(offset, NDJSON_BATCH_ROWS).write_ndjson()
+        for offset in range(0, df.height, NDJSON_BATCH_ROWS)
+    ]
+    header = json.dumps({"type": "ndjson", "columns": df.columns, "rows": df.height, "batches": len(batches)})
+    return [header] + batches
+
+
+def encode_delta(previous, df) -> list:
+    """Encode the change from previous to df, or a full snapshot when a delta cannot express it
+
+    Rows are keyed by the first column; nothing is sent when the version did not change.
+    """
+    delta = row_delta(previous, df)
+    if delta is None:
+        if df is None:
+            return [json.dumps({"type": "snapshot", "key": None, "columns": [], "rows": []})]
+        return [json.dumps({"type": "snapshot", "key": df.columns[0], "columns": df.columns, "rows": df.rows()})]
+    if not delta["upserts"] and not delta["deletes"]:
+        return []
+    return [json.dumps({"type": "delta", **delta})]
+
+
+def encode_frame(df, output_format: str = "columns") -> list:
+    """Encode a cleaned DataFrame as the frames sent to clients"""
+    if output_format == "ndjson":
+        return encode_ndjson(df)
+    return encode_columns(df)
+
+
+def parse_file_data(file_path: str, output_format: str = "columns") -> list:
+    """Read a CSV file and encode it as the frames sent to clients"""
+    return encode_frame(load_file_frame(file_path), output_format)
+
+
+def resolve_folder(folder: str):
+    """FILE_FOLDER or a real folder inside it; None for anything a client could use to escape it"""
+    root = os.path.realpath(FILE_FOLDER)
+    resolved = os.path.realpath(folder)
+    if resolved == root:
+        return FILE_FOLDER
+    if resolved.startswith(root + os.sep):
+        return resolved
+    return None
+
+
+def is_plain_name(name: str) -> bool:
+    """A file name or glob that stays inside its folder: no separators, no "..", not absolute"""
+    return (
+        isinstance(name, str) and bool(name) and ".." not in name
+        and "/" not in name and "\\" not in name and not os.path.isabs(name)
+    )
+
+
+def file_fingerprint(file_path: str):
+    """(size, mtime, inode) identifying a version of the file, or None if it does not exist
+
+    The inode catches an atomic replace that keeps the size within the mtime granularity.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def load_file_frame(file_path: str, trace=None):
+    """Parsed DataFrame for the file's current version, reusing the last snapshot if unchanged"""
+    fingerprint = file_fingerprint(file_path)
+    if fingerprint is None:
+        return None
+    snapshot = snapshots.get(file_path)
+    if snapshot and snapshot["fingerprint"] == fingerprint:
+        if snapshot["empty"]:
+            return None
+        df = frame_cache.get((file_path, fingerprint))
+        if df is not None:
+            return df
+        # Evicted from the cache: read it again below
+    else:
+        frame_cache.misses += 1
+    df = sidecars.read(file_path, fingerprint) if sidecars else None
+    if df is not None:
+        if snapshot and snapshot["fingerprint"] == fingerprint:
+            frame_cache.put((file_path, fingerprint), df)
+        else:
+            # Indexed before it is cached, so an immediate eviction also drops the index
+            row_indexes.update(file_path, df)
+            snapshots.put(file_path, fingerprint, df)
+        return df
+    delay = TORN_READ_BACKOFF
+    for attempt in range(TORN_READ_RETRIES + 1):
+        try:
+            df, fingerprint = read_file_frame(file_path, trace)
+        except TornReadError:
+            snapshots.torn_reads += 1
+            if attempt < TORN_READ_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+            continue
+        if fingerprint is not None:
+            snapshot = snapshots.get(file_path)
+            if snapshot and snapshot["fingerprint"] == fingerprint:
+                # The same version re-read after eviction: restore it, it is not a new version
+                if df is not None:
+                    frame_cache.put((file_path, fingerprint), df)
+            else:
+                row_indexes.update(file_path, df)
+                snapshots.put(file_path, fingerprint, df)
+                if recorder:
+                    recorder.record(os.path.splitext(os.path.basename(file_path))[0], df)
+            if sidecars and df is not None:
+                sidecars.submit(file_path, fingerprint, df)
+        return df
+    # Never publish a half-written file; keep showing the last good version instead
+    print(f"Torn read of {file_path} after {TORN_READ_RETRIES} retries, keeping last good version")
+    return snapshots.frame(file_path)
+
+
+class FrameCache:
+    """Class to share parsed DataFrames keyed by (path, fingerprint) under a memory budget, evicting LRU"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.pins = defaultdict(int)
+        self.lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        with self.lock:
+            df = self.frames.get(key)
+            if df is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return df
+
+    def peek(self, key: tuple):
+        """Look up without touching LRU order or hit counts"""
+        return self.frames.get(key)
+
+    def put(self, key: tuple, df):
+        """Cache a file version; older versions of the same file are dropped"""
+        with self.lock:
+            for old_key in [old_key for old_key in self.frames if old_key[0] == key[0]]:
+                self._remove(old_key)
+            self.frames[key] = df
+            self.sizes[key] = df.estimated_size()
+            self.resident_bytes += self.sizes[key]
+            self._evict()
+
+    def pin(self, file_path: str):
+        with self.lock:
+            self.pins[file_path] += 1
+
+    def unpin(self, file_path: str):
+        with self.lock:
+            self.pins[file_path] -= 1
+            if self.pins[file_path] <= 0:
+                del self.pins[file_path]
+            self._evict()
+
+    def _remove(self, key: tuple):
+        del self.frames[key]
+        self.resident_bytes -= self.sizes.pop(key)
+
+    def _evict(self):
+        if self.resident_bytes <= self.budget:
+            return
+        for key in list(self.frames):
+            if self.resident_bytes <= self.budget:
+                break
+            if key[0] in self.pins:
+                continue
+            self._remove(key)
+            self.evictions += 1
+            # The file's row indexes share its key column and would outlive the budget
+            row_indexes.forget(key[0])
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.frames),
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.budget,
+            "pinned_files": len(self.pins),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+class SnapshotStore:
+    """Class to track the latest parsed version of each file; the DataFrames live in the frame cache"""
+
+    def __init__(self):
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.torn_reads = 0
+
+    def get(self, file_path: str):
+        return self.snapshots.get(file_path)
+
+    def frame(self, file_path: str):
+        """The latest version's DataFrame, or None if it was empty or has been evicted"""
+        snapshot = self.snapshots.get(file_path)
+        if snapshot is None or snapshot["empty"]:
+            return None
+        return frame_cache.peek((file_path, snapshot["fingerprint"]))
+
+    def put(self, file_path: str, fingerprint, df, published_at: float = None):
+        with self.lock:
+            previous = self.snapshots.get(file_path)
+            self.snapshots[file_path] = {
+                "fingerprint": fingerprint,
+                "empty": df is None,
+                "version": previous["version"] + 1 if previous else 1,
+                "published_at": published_at or time.time(),
+            }
+        if df is not None:
+            frame_cache.put((file_path, fingerprint), df)
+
+
+class SidecarCache:
+    """Class to keep a columnar Arrow IPC copy of each parsed file version on disk
+
+    Files are named "<path>@<size>-<mtime_ns>-<inode>.arrow", so a sidecar only ever matches the exact
+    version it was written from. They are uncompressed, which lets polars memory-map them:
+    reading one costs no parsing, and columns a query never touches are never paged in.
+    """
+
+    def __init__(self, directory: str, max_age: float, budget: int):
+        self.directory = directory
+        self.max_age = max_age
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sidecar")
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def path_for(self, file_path: str, fingerprint) -> str:
+        size, mtime_ns, inode = fingerprint
+        name = re.sub(r"[^\w.-]", "_", file_path)
+        return os.path.join(self.directory, f"{name}@{size}-{mtime_ns}-{inode}.arrow")
+
+    def read(self, file_path: str, fingerprint):
+        """The sidecar for this exact version, or None if there is none yet"""
+        path = self.path_for(file_path, fingerprint)
+        try:
+            df = pl.read_ipc(path)
+        except (FileNotFoundError, ComputeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def submit(self, file_path: str, fingerprint, df):
+        """Write the sidecar in the background; the caller already has the DataFrame"""
+        path = self.path_for(file_path, fingerprint)
+        with self.lock:
+            if path in self.pending or os.path.exists(path):
+                return
+            self.pending.add(path)
+        self.executor.submit(self.write, path, df)
+
+    def write(self, path: str, df):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            df.write_ipc(path + ".tmp", compression="uncompressed")
+            os.replace(path + ".tmp", path)
+            self.writes += 1
+            self.evict()
+        except Exception as e:
+            print(f"Error writing sidecar {path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def evict(self):
+        """Drop superseded versions, sidecars past max_age, then the oldest ones over budget"""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".arrow") or (entry.name.endswith(".tmp") and entry.path[:-4] not in self.pending):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name, entry.path))
+        entries.sort(reverse=True)
+        latest = set()
+        kept = []
+        for mtime, size, name, path in entries:
+            source = name.rsplit("@", 1)[0]
+            if name.endswith(".tmp") or source in latest or now - mtime > self.max_age:
+                self.remove(path)
+                continue
+            latest.add(source)
+            kept.append((size, path))
+        total = sum(size for size, path in kept)
+        while kept and total > self.budget:
+            size, path = kept.pop()
+            self.remove(path)
+            total -= size
+
+    def remove(self, path: str):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def metrics(self) -> dict:
+        sizes = [
+            entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".arrow")
+        ] if os.path.isdir(self.directory) else []
+        return {
+            "files": len(sizes),
+            "bytes": sum(sizes),
+            "budget_bytes": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+class RowHashIndex:
+    """Class to map each row's key to a 64-bit hash of the whole row, so versions diff as hash joins"""
+
+    def __init__(self, key: str, hashes, schema):
+        self.key = key
+        self.hashes = hashes
+        self.schema = schema
+        self.unique = not hashes.get_column(key).is_duplicated().any()
+
+    @classmethod
+    def build(cls, df, key: str = None):
+        """Index df by key (its first column by default); None for a frame without that column"""
+        if df is None or not df.width:
+            return None
+        key = key or df.columns[0]
+        if key not in df.columns:
+            return None
+        return cls(key, df.select(pl.col(key), df.hash_rows().alias("_hash")), df.schema)
+
+    def extend(self, df):
+        """Index a newer version of an append-only file, hashing only the rows past the old height"""
+        height = self.hashes.height
+        if df is None or df.schema != self.schema or df.height < height or not height:
+            return RowHashIndex.build(df, self.key)
+        boundary = pl.concat([df.slice(0, 1), df.slice(height - 1, 1)]).hash_rows().to_list()
+        if boundary != [self.hashes["_hash"][0], self.hashes["_hash"][height - 1]]:
+            return RowHashIndex.build(df, self.key)
+        tail = df.slice(height)
+        hashes = pl.concat([self.hashes, tail.select(pl.col(self.key), tail.hash_rows().alias("_hash"))])
+        return RowHashIndex(self.key, hashes, df.schema)
+
+    def diff(self, newer: 'RowHashIndex'):
+        """(new or changed keys, removed keys) from this version to newer, or None if not comparable"""
+        if newer is None or newer.key != self.key or newer.schema != self.schema:
+            return None
+        changed = newer.hashes.join(self.hashes, on=[self.key, "_hash"], how="anti").get_column(self.key)
+        removed = self.hashes.join(newer.hashes, on=self.key, how="anti").get_column(self.key)
+        return changed, removed
+
+
+class RowIndexStore:
+    """Class to keep the row-hash indexes of each file's recent versions, shared by every consumer
+
+    Entries hold the DataFrame weakly, so the frame cache stays in charge of evicting data;
+    a file it evicts is forgotten here as well.
+    """
+
+    KEEP_VERSIONS = 2
+
+    def __init__(self, tail_patterns: list):
+        self.tail_patterns = tail_patterns
+        self.recent = {}
+        self.frames = {}
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.tail_updates = 0
+        self.reused = 0
+
+    def is_tail(self, source: str) -> bool:
+        name = os.path.basename(source)
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.tail_patterns)
+
+    def lookup(self, df):
+        entry = self.frames.get(id(df))
+        if entry and entry[0]() is df:
+            return entry[1]
+        return None
+
+    def update(self, source: str, df):
+        """Index a new version of source, incrementally from the previous one in tail mode"""
+        if df is None:
+            return None
+        with self.lock:
+            index = self.lookup(df)
+            if index is not None:
+                return index
+            recent = self.recent.setdefault(source, deque())
+            previous = self.frames.get(recent[-1]) if recent else None
+        if previous and previous[1] is not None and self.is_tail(source):
+            index = previous[1].extend(df)
+            self.tail_updates += 1
+        else:
+            index = RowHashIndex.build(df)
+            self.builds += 1
+        with self.lock:
+            self.frames[id(df)] = (weakref.ref(df), index)
+            recent.append(id(df))
+            while len(recent) > self.KEEP_VERSIONS:
+                self.frames.pop(recent.popleft(), None)
+        return index
+
+    def index_of(self, df, key: str = None):
+        """The stored index of a tracked version, or one built on the spot"""
+        if df is None:
+            return None
+        index = self.lookup(df)
+        if index is not None and (key is None or index.key == key):
+            self.reused += 1
+            return index
+        return RowHashIndex.build(df, key)
+
+    def forget(self, source: str):
+        with self.lock:
+            for frame_id in self.recent.pop(source, ()):
+                self.frames.pop(frame_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "sources": len(self.recent),
+            "builds": self.builds,
+            "tail_updates": self.tail_updates,
+            "reused": self.reused,
+        }
+
+
+class TopNView:
+    """Class to maintain the top-N rows of a file by one column, incrementally across versions"""
+
+    def __init__(self, sort_by: str, top_n: int, descending: bool = True, key: str = None):
+        self.sort_by = sort_by
+        self.top_n = top_n
+        self.descending = descending
+        self.key = key
+        self.window = None
+        self.index = None
+        self.full_sorts = 0
+        self.incremental_sorts = 0
+
+    def select(self, df):
+        if self.descending:
+            return df.top_k(self.top_n, by=self.sort_by)
+        return df.bottom_k(self.top_n, by=self.sort_by)
+
+    def update(self, df) -> dict:
+        """Fold in a new version; returns the frame for the client
+
+        "changes" lists rank moves by row key, or is None when the window holds duplicate
+        keys and a key does not identify one row.
+        """
+        if df is None:
+            df = self.window.clear() if self.window is not None else pl.DataFrame()
+        if df.width and self.sort_by not in df.columns:
+            return {"type": "topn", "error": f"Unknown sort_by column {self.sort_by}"}
+        key = self.key or (df.columns[0] if df.width else None)
+        previous_ranks = self.ranks(key)
+        index = row_indexes.index_of(df, key) if key else None
+
+        window = self.incremental(df, key, index) if self.can_update_incrementally(df, key, index) else None
+        if window is None:
+            window = self.select(df) if df.width else df
+            self.full_sorts += 1
+        else:
+            self.incremental_sorts += 1
+        self.window, self.index = window, index
+
+        ranks = self.ranks(key)
+        changes = None
+        if previous_ranks is not None and ranks is not None:
+            changes = [
+                {"key": row_key, "from": previous_ranks.get(row_key), "to": ranks.get(row_key)}
+                for row_key in previous_ranks.keys() | ranks.keys()
+                if previous_ranks.get(row_key) != ranks.get(row_key)
+            ]
+        return {"type": "topn", "sort_by": self.sort_by, "key": key, "rows": window.to_dicts(), "changes": changes}
+
+    def can_update_incrementally(self, df, key, index) -> bool:
+        return (
+            key is not None and self.window is not None and self.index is not None and index is not None
+            and self.window.schema == df.schema and self.index.key == key
+            # The key diff cannot tell rows with the same key apart
+            and self.index.unique and index.unique
+        )
+
+    def incremental(self, df, key, index):
+        """Re-sort only the previous window plus changed rows, or None if a full sort is needed"""
+        diff = self.index.diff(index)
+        if diff is None:
+            return None
+        changed_keys, removed_keys = diff
+        window_keys = self.window.get_column(key)
+        if removed_keys.is_in(window_keys.implode()).any():
+            return None
+        if self.window.height == self.top_n:
+            # A window row that dropped below the old cut-off may be overtaken by rows we did not re-check
+            threshold = self.window.get_column(self.sort_by).min() if self.descending else self.window.get_column(self.sort_by).max()
+            changed = df.filter(pl.col(key).is_in(changed_keys.implode()))
+            moved = changed.filter(pl.col(key).is_in(window_keys.implode()))
+            worse = pl.col(self.sort_by) < threshold if self.descending else pl.col(self.sort_by) > threshold
+            if moved.filter(worse | pl.col(self.sort_by).is_null()).height:
+                return None
+        else:
+            changed = df.filter(pl.col(key).is_in(changed_keys.implode()))
+        unchanged = self.window.filter(~pl.col(key).is_in(changed_keys.implode()))
+        return self.select(pl.concat([unchanged, changed]))
+
+    def ranks(self, key) -> dict:
+        if self.window is None or key is None or key not in self.window.columns:
+            return {}
+        if self.window.get_column(key).is_duplicated().any():
+            return None
+        return {row_key: rank for rank, row_key in enumerate(self.window.get_column(key).to_list(), start=1)}
+
+
+class VersionLog:
+    """Class to append versions of one key to a log file with a fixed-width index for seeking
+
+    <key>.log holds one JSON record per version, either a keyframe with the full data or a
+    delta of upserted rows and deleted keys. <key>.idx holds (version, time, offset, keyframe)
+    entries in the same order, so a version or time can be found by binary search.
+    """
+
+    INDEX_ENTRY = struct.Struct("<QdQQ")
+
+    def __init__(self, directory: str, key: str):
+        base = os.path.join(directory, re.sub(r"[^\w.-]", "_", key))
+        self.log_path = base + ".log"
+        self.index_path = base + ".idx"
+        self.lock = threading.Lock()
+        self.log = None
+        self.index = None
+        self.previous = None
+        self.version = 0
+        if os.path.exists(self.index_path):
+            self.version = os.path.getsize(self.index_path) // self.INDEX_ENTRY.size
+
+    def append(self, df, keyframe_every: int):
+        with self.lock:
+            if self.log is None:
+                self.log = open(self.log_path, "ab")
+                self.index = open(self.index_path, "ab")
+            self.version += 1
+            record = {"v": self.version, "t": time.time()}
+            delta = None
+            if self.previous is not None and (self.version - 1) % keyframe_every != 0:
+                delta = row_delta(self.previous, df)
+            if delta is None:
+                record.update(kf=True, data=df.to_dict(as_series=False) if df is not None else {})
+            else:
+                record.update(kf=False, **delta)
+            self.previous = df
+            offset = self.log.tell()
+            self.log.write(json.dumps(record).encode() + b"\n")
+            self.log.flush()
+            self.index.write(self.INDEX_ENTRY.pack(self.version, record["t"], offset, int(record["kf"])))
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            if self.log:
+                self.log.close()
+                self.index.close()
+                self.log = self.index = None
+
+
+def row_delta(previous, df):
+    """Rows of df that are new or changed and keys that disappeared, keyed by the first column
+
+    Returns None when a delta cannot express the change (schema change, duplicate keys).
+    """
+    if previous is None or df is None or previous.schema != df.schema or not df.width:
+        return None
+    previous_index, index = row_indexes.index_of(previous), row_indexes.index_of(df)
+    if not (previous_index.unique and index.unique):
+        return None
+    diff = previous_index.diff(index)
+    if diff is None:
+        return None
+    changed, removed = diff
+    upserts = df.filter(pl.col(index.key).is_in(changed.implode()))
+    return {"key": index.key, "upserts": upserts.to_dicts(), "deletes": removed.to_list()}
+
+
+def apply_delta(df, record: dict):
+    """Rebuild a version from the previous one and a log record"""
+    if record["kf"]:
+        return pl.DataFrame(record["data"]) if record["data"] else None
+    key = record["key"]
+    touched = record["deletes"] + [row[key] for row in record["upserts"]]
+    kept = df.filter(~pl.col(key).is_in(touched))
+    if not record["upserts"]:
+        return kept
+    return pl.concat([kept, pl.DataFrame(record["upserts"], schema=df.schema)])
+
+
+class VersionIndex:
+    """Read-only view of a .idx file that bisect can search without loading it"""
+
+    def __init__(self, index_path: str):
+        with open(index_path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(index_path) else b""
+
+    def __len__(self):
+        return len(self.buffer) // VersionLog.INDEX_ENTRY.size
+
+    def __getitem__(self, position: int) -> tuple:
+        return VersionLog.INDEX_ENTRY.unpack_from(self.buffer, position * VersionLog.INDEX_ENTRY.size)
+
+    def find_time(self, timestamp: float) -> int:
+        """Position of the last entry at or before timestamp (0 if none)"""
+        return max(bisect.bisect_right(self, timestamp, key=lambda entry: entry[1]) - 1, 0)
+
+    def keyframe_before(self, position: int) -> int:
+        while position > 0 and not self[position][3]:
+            position -= 1
+        return position
+
+
+class VersionRecorder:
+    """Class to record every published version of each key into its VersionLog"""
+
+    def __init__(self, directory: str, keyframe_every: int = RECORD_KEYFRAME_EVERY):
+        self.directory = directory
+        self.keyframe_every = keyframe_every
+        self.logs = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, key: str, df):
+        with self.lock:
+            log = self.logs.get(key)
+            if log is None:
+                log = self.logs[key] = VersionLog(self.directory, key)
+        try:
+            log.append(df, self.keyframe_every)
+        except Exception as e:
+            print(f"Error recording version of {key}: {e}")
+
+    def paths(self, key: str):
+        log = VersionLog(self.directory, key)
+        if not os.path.exists(log.index_path):
+            return None
+        return log.log_path, log.index_path
+
+    def close(self):
+        for log in list(self.logs.values()):
+            log.close()
+
+
+class ParsePool:
+    """Class to run file parsing in a bounded worker pool, one job per file at a time"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="parse")
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.shared = 0
+
+    async def parse(self, file_path: str, output_format: str = "columns", trace=None):
+        """Parse a file, joining the in-flight job if one is already running for it
+
+        Returns the encoded frames, or the DataFrame itself when output_format is None.
+        """
+        job_key = (file_path, output_format)
+        future = self.inflight.get(job_key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._run, file_path, output_format, trace)
+            self.inflight[job_key] = future
+            self.submitted += 1
+            future.add_done_callback(lambda _: self.inflight.pop(job_key, None))
+        else:
+            self.shared += 1
+        # Shield so one cancelled waiter does not cancel the job for the others
+        return await asyncio.shield(future)
+
+    def _run(self, file_path: str, output_format: str, trace=None):
+        with self.lock:
+            self.running += 1
+        try:
+            df = load_file_frame(file_path, trace)
+            if output_format is None:
+                return df
+            with span(trace, "encode", format=output_format):
+                return encode_frame(df, output_format)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def encode(self, df, output_format: str = "columns") -> list:
+        """Encode an already parsed DataFrame on the pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, encode_frame, df, output_format)
+
+    async def call(self, func, *args):
+        """Run other per-version work (sorting, diffing) on the pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def metrics(self) -> dict:
+        """Pool usage; saturation is the fraction of workers busy"""
+        queued = self.submitted - self.completed - self.running
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": max(queued, 0),
+            "inflight_files": len(self.inflight),
+            "submitted": self.submitted,
+            "shared": self.shared,
+            "saturation": self.running / self.max_workers,
+        }
+
+
+class FolderWatcher:
+    """Class to keep an in-memory index of one folder and notify matching subscribers of changes"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.index = {}
+        self.subscribers = {}
+        self.task = None
+        self.scanned = asyncio.Event()
+
+    def scan(self) -> dict:
+        """Map file name -> (size, mtime, inode) for every file in the folder"""
+        index = {}
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or entry.name.endswith(TEMP_FILE_SUFFIXES):
+                        continue
+                    if entry.is_file():
+                        stat = entry.stat()
+                        index[entry.name] = (stat.st_size, stat.st_mtime_ns, entry.inode())
+        except FileNotFoundError:
+            pass
+        return index
+
+    async def subscribe(self, session: 'UserSession', pattern: str) -> list:
+        """Register a session for files matching pattern; returns the names currently matching
+
+        The session is registered before the first scan is awaited, so an unsubscribe during
+        the scan finds it and stops the watcher; it then gets an empty list.
+        """
+        self.subscribers[session] = pattern
+        if self.task is None:
+            self.task = asyncio.create_task(self.watch())
+        await self.scanned.wait()
+        if session not in self.subscribers:
+            return []
+        return sorted(name for name in self.index if fnmatch.fnmatchcase(name, pattern))
+
+    def unsubscribe(self, session: 'UserSession') -> bool:
+        """Drop a session; returns True once the folder has no subscribers left"""
+        self.subscribers.pop(session, None)
+        if not self.subscribers and self.task:
+            self.task.cancel()
+            self.task = None
+            # Release subscribe calls still waiting on a first scan that will not finish
+            self.scanned.set()
+        return not self.subscribers
+
+    async def watch(self):
+        self.index = await asyncio.to_thread(self.scan)
+        self.scanned.set()
+        while self.subscribers:
+            await asyncio.sleep(WATCH_INTERVAL)
+            index = await asyncio.to_thread(self.scan)
+            previous, self.index = self.index, index
+            events = [("removed", name) for name in previous.keys() - index.keys()]
+            events += [
+                ("added" if name not in previous else "updated", name)
+                for name, stat in index.items() if previous.get(name) != stat
+            ]
+            if events:
+                self.dispatch(events)
+
+    def dispatch(self, events: list):
+        """Hand each event to its sessions' outboxes; delivery never holds up the next scan
+
+        The root span of a sampled update ends at the hand-off; each session's send adds its
+        own child spans when it runs.
+        """
+        traces = {name: tracer.start("file_update", file=name, event=event) for event, name in events}
+        for session, pattern in list(self.subscribers.items()):
+            for event, name in events:
+                if fnmatch.fnmatchcase(name, pattern):
+                    session.on_file_event(event, name, traces[name])
+        for trace in traces.values():
+            if trace:
+                trace.end()
+
+
+class WatcherRegistry:
+    """Class to share one FolderWatcher per folder between all sessions"""
+
+    def __init__(self):
+        self.watchers = {}
+
+    async def subscribe(self, session: 'UserSession', folder: str, pattern: str) -> list:
+        watcher = self.watchers.get(folder)
+        if watcher is None:
+            watcher = self.watchers[folder] = FolderWatcher(folder)
+        return await watcher.subscribe(session, pattern)
+
+    def unsubscribe(self, session: 'UserSession', folder: str):
+        watcher = self.watchers.get(folder)
+        if watcher and watcher.unsubscribe(session):
+            del self.watchers[folder]
+
+
+def limit_producer_resources(pid: int):
+    """Apply address-space and CPU-time limits to a running producer
+
+    Done from the parent with prlimit rather than in a preexec_fn, which is not safe to run
+    in a child forked while the parse, sidecar and trace threads hold locks.
+    """
+    try:
+        if PRODUCER_MAX_MEMORY:
+            resource.prlimit(pid, resource.RLIMIT_AS, (PRODUCER_MAX_MEMORY, PRODUCER_MAX_MEMORY))
+        if PRODUCER_MAX_CPU_SECONDS:
+            # SIGXCPU at the soft limit, SIGKILL shortly after
+            resource.prlimit(pid, resource.RLIMIT_CPU, (PRODUCER_MAX_CPU_SECONDS, PRODUCER_MAX_CPU_SECONDS + 5))
+    except ProcessLookupError:
+        pass
+
+
+class ProducerLog:
+    """Class to keep the recent output of one producer in a bounded ring buffer"""
+
+    def __init__(self, process_key: str, max_lines: int = PRODUCER_LOG_LINES, spill_dir: str = PRODUCER_LOG_DIR):
+        self.lines = deque(maxlen=max_lines)
+        self.handler = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            file_name = re.sub(r"[^\w.-]", "_", process_key) + ".log"
+            self.handler = RotatingFileHandler(
+                os.path.join(spill_dir, file_name), maxBytes=PRODUCER_LOG_MAX_BYTES, backupCount=PRODUCER_LOG_BACKUPS
+            )
+            self.handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+    async def drain(self, stream, stream_name: str):
+        """Read a pipe until EOF so the producer never blocks on a full pipe"""
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line longer than the stream limit: take what is buffered and carry on
+                line = await stream.read(64 * 1024)
+            if not line:
+                break
+            text = line.decode(errors="replace").rstrip("\n")
+            self.lines.append({"time": time.time(), "stream": stream_name, "line": text})
+            if self.handler:
+                self.handler.emit(logging.makeLogRecord({"msg": f"{stream_name}: {text}"}))
+
+    def tail(self, count: int) -> list:
+        return list(self.lines)[-count:] if count > 0 else []
+
+    def close(self):
+        if self.handler:
+            self.handler.close()
+
+
+class ProducerRegistry:
+    """Class to look up in-process producers registered in code or through entry points"""
+
+    def __init__(self, group: str):
+        self.group = group
+        self.producers = {}
+
+    def register(self, name: str):
+        """Decorator registering an async producer(file_name, file_folder, publish) under name"""
+        def decorator(producer):
+            self.producers[name] = producer
+            return producer
+        return decorator
+
+    def load_entry_points(self):
+        for entry_point in entry_points(group=self.group):
+            try:
+                self.producers.setdefault(entry_point.name, entry_point.load())
+            except Exception as e:
+                print(f"Error loading producer plugin {entry_point.name}: {e}")
+
+    def get(self, name: str):
+        return self.producers.get(name)
+
+
+class InProcessProducer:
+    """Class running a registered producer as a task, with the same lifecycle interface as a subprocess"""
+
+    pid = None
+
+    def __init__(self, process_key: str, producer, file_name: str, file_folder: str):
+        publish = functools.partial(broadcaster.publish, process_key)
+        self.task = asyncio.create_task(producer(file_name, file_folder, publish))
+
+    @property
+    def returncode(self):
+        if not self.task.done():
+            return None
+        if self.task.cancelled():
+            return -signal.SIGTERM
+        return 1 if self.task.exception() else 0
+
+    async def wait(self) -> int:
+        try:
+            # Shielded so a timed-out waiter does not cancel the producer itself
+            await asyncio.shield(self.task)
+        except asyncio.CancelledError:
+            if not self.task.done():
+                raise
+        except Exception as e:
+            print(f"In-process producer failed: {e}")
+        return self.returncode
+
+    def terminate(self):
+        self.task.cancel()
+
+    def kill(self):
+        self.task.cancel()
+
+
+class Broadcaster:
+    """Class to push DataFrames published by in-process producers straight to their sessions"""
+
+    def __init__(self):
+        self.latest = {}
+        self.published = {}
+
+    async def publish(self, process_key: str, df):
+        """Called by a producer with each new version of its data"""
+        df = clean_frame(df)
+        self.latest[process_key] = df
+        version = (self.published.get(process_key, (0, None))[0] or 0) + 1
+        self.published[process_key] = (version, time.time())
+        await parse_pool.call(row_indexes.update, process_key, df)
+        if recorder:
+            await parse_pool.call(recorder.record, process_key, df)
+        entry = process_manager.processes.get(process_key)
+        sessions = list(entry["sessions"]) if entry else []
+        # Encode once per format in use, not once per session
+        encoded = {}
+        for output_format in {session.output_format for session in sessions if not session.wants_frames()}:
+            encoded[output_format] = await parse_pool.encode(df, output_format)
+        await asyncio.gather(*(
+            manager.outbox(session.websocket).admit(
+                session.process_key,
+                functools.partial(session.send_frame_update, df) if session.wants_frames()
+                else functools.partial(session.send_frames, encoded[session.output_format])
+            )
+            for session in sessions
+        ))
+
+    async def send_latest(self, process_key: str, session: 'UserSession'):
+        """Give a new session the last published version, if there is one"""
+        if process_key not in self.latest:
+            return
+        if session.wants_frames():
+            await session.send_frame_update(self.latest[process_key])
+        else:
+            await session.send_frames(await parse_pool.encode(self.latest[process_key], session.output_format))
+
+    def forget(self, process_key: str):
+        self.latest.pop(process_key, None)
+        self.published.pop(process_key, None)
+        row_indexes.forget(process_key)
+
 
 class ProcessManager:
     """Class to manage processes and associated user sessions"""
 
-    def __init__(self):
+    def __init__(self, max_processes: int = MAX_PRODUCERS, max_per_client: int = MAX_PRODUCERS_PER_CLIENT):
         self.processes = {}
+        self.max_processes = max_processes
+        self.max_per_client = max_per_client
+        self.client_processes = defaultdict(set)
+        self.waiters = []
+        self.spawning = 0
+        self.starting = {}
+        self.logs = {}
+        self.draining = False
+
+    async def start_process(self, process_key: str, file_name: str, file_folder: str, client: str = None, notify=None, producer: str = None,
+                            bypass_queue: bool = False, owner=None):
+        """Start the subprocess if not already running, waiting in line if over the producer limits
 
-    async def start_process(self, process_key: str, file_name: str, file_folder: str):
-        """Start the subprocess if not already running"""
-        if process_key not in self.processes:
-            process = subprocess.Popen(["nohup", "python", "main.py", file_name, file_folder])
+        bypass_queue admits immediately even over the limits; restore uses it because only a
+        connected client could ever free the slot it would wait for. owner (the requesting
+        socket) lets cancel_waiters give up the place in line when that socket goes away.
+        """
+        while True:
+            if process_key in self.starting:
+                await self.starting[process_key].wait()
+            if process_key in self.processes or self.draining:
+                return
+            if bypass_queue or (not self.waiters and self.can_admit(client)):
+                self.spawning += 1
+            else:
+                await self.wait_for_slot(process_key, client, notify, owner)
+            if process_key not in self.starting:
+                break
+            # Another call began spawning this key while we queued: give the slot back and wait on it
+            self.spawning -= 1
+            await self.admit_waiters()
+        # Registered before the next await, so concurrent callers see the spawn in flight
+        started = self.starting[process_key] = asyncio.Event()
+        try:
+            if process_key in self.processes or self.draining:
+                return
+            trace = tracer.start("producer_start", key=process_key, producer=producer)
+            with span(trace, "spawn"):
+                if producer:
+                    process = InProcessProducer(process_key, producers.get(producer), file_name, file_folder)
+                else:
+                    process = await self.spawn(process_key, file_name, file_folder)
+            if trace:
+                trace.end()
             self.processes[process_key] = {
                 "process": process,
-                "sessions": set()
+                "sessions": set(),
+                "started": time.time(),
+                "client": client,
+                "file_name": file_name,
+                "file_folder": file_folder,
+                "producer": producer,
+                "reaper": asyncio.create_task(self.reap(process_key, process))
             }
-            print(f"Started process {process_key} with PID: {process.pid}")
+            self.client_processes[client].add(process_key)
+            if producer:
+                print(f"Started in-process producer {producer} for {process_key}")
+            else:
+                print(f"Started process {process_key} with PID: {process.pid}")
+        finally:
+            self.starting.pop(process_key, None)
+            started.set()
+            self.spawning -= 1
+            await self.admit_waiters()
+
+    async def spawn(self, process_key: str, file_name: str, file_folder: str):
+        """Start a producer subprocess with its output drained into a ProducerLog"""
+        process = await asyncio.create_subprocess_exec(
+            *PRODUCER_COMMAND, file_name, file_folder,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=1024 ** 2,
+            # Own session: a SIGTERM to the server's process group must not stop producers
+            # before the drain has checkpointed them
+            start_new_session=True
+        )
+        limit_producer_resources(process.pid)
+        if process_key in self.logs:
+            self.logs.pop(process_key).close()
+        log = self.logs[process_key] = ProducerLog(process_key)
+        asyncio.create_task(log.drain(process.stdout, "stdout"))
+        asyncio.create_task(log.drain(process.stderr, "stderr"))
+        return process
+
+    def is_in_process(self, process_key: str) -> bool:
+        entry = self.processes.get(process_key)
+        return entry is not None and isinstance(entry["process"], InProcessProducer)
+
+    async def reap(self, process_key: str, process):
+        """Wait for the producer to exit; if nobody stopped it, detach its sessions"""
+        returncode = await process.wait()
+        entry = self.processes.get(process_key)
+        if entry is None or entry["process"] is not process:
+            return
+        print(f"Process {process_key} with PID: {process.pid} exited on its own with code {returncode}")
+        del self.processes[process_key]
+        broadcaster.forget(process_key)
+        self.release_client(process_key, entry["client"])
+        await asyncio.gather(*(session.producer_exited(returncode) for session in list(entry["sessions"])))
+        await self.admit_waiters()
+
+    def release_client(self, process_key: str, client: str):
+        self.client_processes[client].discard(process_key)
+        if not self.client_processes[client]:
+            del self.client_processes[client]
+
+    def can_admit(self, client: str) -> bool:
+        if self.max_processes and len(self.processes) + self.spawning >= self.max_processes:
+            return False
+        if self.max_per_client and len(self.client_processes.get(client, ())) >= self.max_per_client:
+            return False
+        return True
+
+    async def wait_for_slot(self, process_key: str, client: str, notify, owner=None):
+        """Queue until admitted; the caller owns a spawning slot when this returns"""
+        waiter = {"key": process_key, "client": client, "notify": notify, "owner": owner,
+                  "future": asyncio.get_running_loop().create_future()}
+        self.waiters.append(waiter)
+        print(f"Queued process {process_key}, {len(self.waiters)} waiting")
+        await self.notify_positions()
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                await self.notify_positions()
+            elif waiter["future"].done() and not waiter["future"].cancelled():
+                # Admitted just as we were cancelled: hand the slot back
+                self.spawning -= 1
+                await self.admit_waiters()
+            raise
+
+    def cancel_waiters(self, owner):
+        """Drop the queued requests of a socket that has gone, so only live clients get slots"""
+        for waiter in self.waiters:
+            if waiter["owner"] is owner:
+                waiter["future"].cancel()
+
+    async def admit_waiters(self):
+        """Admit queued requests in FIFO order, skipping clients that are at their own limit"""
+        if self.draining:
+            return
+        admitted = False
+        for waiter in list(self.waiters):
+            # A waiter whose producer was started by someone else needs no new slot
+            if waiter["key"] in self.processes or self.can_admit(waiter["client"]):
+                self.waiters.remove(waiter)
+                self.spawning += 1
+                waiter["future"].set_result(True)
+                admitted = True
+        if admitted:
+            await self.notify_positions()
+
+    async def notify_positions(self):
+        for position, waiter in enumerate(self.waiters, start=1):
+            if waiter["notify"]:
+                try:
+                    await waiter["notify"]({"status": "queued", "key": waiter["key"], "position": position})
+                except Exception as e:
+                    print(f"Error notifying queued request {waiter['key']}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "running": len(self.processes),
+            "limit": self.max_processes,
+            "per_client_limit": self.max_per_client,
+            "queued": len(self.waiters),
+        }
 
     async def stop_process(self, process_key: str):
         """Stop the subprocess if no more sessions are using it"""
         if process_key in self.processes and len(self.processes[process_key]["sessions"]) == 0:
-            process = self.processes[process_key]["process"]
+            entry = self.processes.pop(process_key)
+            broadcaster.forget(process_key)
+            self.release_client(process_key, entry["client"])
+            await self.admit_waiters()
+            trace = tracer.start("producer_stop", key=process_key)
+            with span(trace, "terminate"):
+                await self.terminate(process_key, entry["process"])
+            if trace:
+                trace.end()
+            # A producer that crashed keeps its log for inspection; a stopped one does not need it
+            if process_key not in self.processes and process_key in self.logs:
+                self.logs.pop(process_key).close()
+
+    async def stop_all(self, timeout: float):
+        """Stop every producer in parallel; whatever is still alive at the deadline is killed"""
+        self.draining = True
+        entries = list(self.processes.items())
+        self.processes.clear()
+        for waiter in self.waiters:
+            waiter["future"].cancel()
+        self.waiters.clear()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self.terminate(key, entry["process"]) for key, entry in entries)),
+                max(timeout, 0)
+            )
+        except asyncio.TimeoutError:
+            for key, entry in entries:
+                if entry["process"].returncode is None:
+                    print(f"Killing process {key} with PID: {entry['process'].pid} at drain deadline")
+                    entry["process"].kill()
+
+    async def terminate(self, process_key: str, process):
+        """SIGTERM, then SIGKILL if the producer has not exited within PRODUCER_STOP_TIMEOUT"""
+        print(f"Stopping process {process_key} with PID: {process.pid}")
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), PRODUCER_STOP_TIMEOUT)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
             print(f"Killing process {process_key} with PID: {process.pid}")
             process.kill()
-            del self.processes[process_key]
+            await process.wait()
 
     async def add_session(self, process_key: str, session: 'UserSession'):
         """Add a session to the process"""
@@ -47,70 +1654,697 @@ class ProcessManager:
         """Remove a session from the process"""
         if process_key in self.processes:
             self.processes[process_key]["sessions"].discard(session)
-            await self.stop_process(process_key)
+            # While draining, producers are checkpointed and stopped together by stop_all
+            if not self.draining:
+                await self.stop_process(process_key)
+
+
+class TokenBucket:
+    """Class to meter a rate; a send may overdraw it, and the debt is repaid before the next one"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def spend(self, amount: float):
+        self.refill()
+        self.tokens -= amount
+
+    def delay(self) -> float:
+        """Seconds until the bucket is out of debt"""
+        self.refill()
+        return max(-self.tokens / self.rate, 0)
+
+
+class Quota:
+    """Class to hold the bytes/sec and frames/sec buckets of one connection or one user"""
+
+    def __init__(self, bytes_per_sec: float, frames_per_sec: float, burst: float = QUOTA_BURST):
+        self.bytes = TokenBucket(bytes_per_sec, burst) if bytes_per_sec else None
+        self.frames = TokenBucket(frames_per_sec, burst) if frames_per_sec else None
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.coalesced = 0
+
+    def spend(self, size: int):
+        self.bytes_sent += size
+        self.frames_sent += 1
+        if self.bytes:
+            self.bytes.spend(size)
+        if self.frames:
+            self.frames.spend(1)
+
+    def delay(self) -> float:
+        return max([bucket.delay() for bucket in (self.bytes, self.frames) if bucket] or [0])
+
+    def metrics(self) -> dict:
+        return {
+            "bytes_per_sec": self.bytes.rate if self.bytes else None,
+            "frames_per_sec": self.frames.rate if self.frames else None,
+            "bytes_available": self.bytes.tokens if self.bytes else None,
+            "frames_available": self.frames.tokens if self.frames else None,
+            "bytes_sent": self.bytes_sent,
+            "frames_sent": self.frames_sent,
+            "coalesced": self.coalesced,
+        }
+
+
+class Outbox:
+    """Class to coalesce the frames bound for one connection into one message per batching window
+
+    Live updates also pass through admit(), which holds them back while the connection or
+    its user is over quota.
+    """
+
+    def __init__(self, websocket: WebSocket, window: float = 0, quota: Quota = None, user_quota: Quota = None):
+        self.websocket = websocket
+        self.window = window
+        self.pending = []
+        self.flusher = None
+        self.batches_sent = 0
+        self.frames_batched = 0
+        self.quota = quota or Quota(0, 0)
+        self.user_quota = user_quota
+        self.deferred = {}
+        self.releaser = None
+
+    def delay(self) -> float:
+        return max(self.quota.delay(), self.user_quota.delay() if self.user_quota else 0)
+
+    async def admit(self, key: str, send):
+        """Run an update for key now if within quota, else keep it as that key's newest pending update
+
+        send is a coroutine function that reads and encodes the data when it runs, so a deferred
+        update always goes out with the latest version and deltas stay relative to what was sent.
+        """
+        if not self.deferred and not self.delay():
+            await send()
+            return
+        self.post(key, send)
+
+    def post(self, key: str, send):
+        """Like admit, but the update always runs from the outbox's own task, never the caller's
+
+        Used where one slow connection must not hold up the caller's other work (the folder
+        watcher's scan loop); updates for a key still pending are coalesced to the newest.
+        """
+        if key in self.deferred:
+            self.quota.coalesced += 1
+            if self.user_quota:
+                self.user_quota.coalesced += 1
+        self.deferred[key] = send
+        if self.releaser is None:
+            self.releaser = asyncio.create_task(self.release_later())
+
+    async def release_later(self):
+        try:
+            while self.deferred:
+                await asyncio.sleep(self.delay())
+                if self.delay():
+                    continue
+                key = next(iter(self.deferred))
+                send = self.deferred.pop(key)
+                try:
+                    await send()
+                except Exception as e:
+                    print(f"Exception while sending deferred update for {key}: {e}")
+        finally:
+            self.releaser = None
+
+    def spend(self, message: str):
+        self.quota.spend(len(message))
+        if self.user_quota:
+            self.user_quota.spend(len(message))
+
+    @property
+    def stage(self) -> str:
+        """Trace span name for handing a frame to this outbox"""
+        return "enqueue" if self.window else "socket_write"
+
+    async def send(self, message: str, batchable: bool = True):
+        """Queue a JSON frame for the next batch, or send it now when batching is off
+
+        Frames that are not a single JSON document (ndjson row batches) are never batched;
+        anything already queued is flushed first so the order is kept.
+        """
+        if not self.window or not batchable:
+            await self.flush()
+            await self.websocket.send_text(message)
+            self.spend(message)
+            return
+        self.pending.append(message)
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Exception while sending batch: {e}")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        frames, self.pending = self.pending, []
+        if len(frames) == 1:
+            await self.websocket.send_text(frames[0])
+            self.spend(frames[0])
+            return
+        # Frames are already JSON, so they are spliced in rather than decoded and re-encoded
+        message = '{"type": "batch", "frames": [' + ",".join(frames) + "]}"
+        await self.websocket.send_text(message)
+        self.spend(message)
+        self.batches_sent += 1
+        self.frames_batched += len(frames)
+
+    def close(self):
+        if self.flusher:
+            self.flusher.cancel()
+            self.flusher = None
+        if self.releaser:
+            self.releaser.cancel()
+            self.releaser = None
+        self.pending = []
+        self.deferred = {}
 
 
 class UserSession:
     """Class to manage the data sending for each user"""
 
-    def __init__(self, websocket: WebSocket, process_key: str):
+    def __init__(self, websocket: WebSocket, process_key: str, output_format: str = "columns", folder: str = FILE_FOLDER):
         self.websocket = websocket
         self.process_key = process_key
+        self.output_format = output_format
+        self.folder = folder
+        self.pinned = None
+        self.closed = False
+        self.view = None
+        self.previous = None
+        self.painted = None
+        self.connected_at = time.time()
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.last_send_latency = None
+
+    async def start(self, file_name: str, client: str, producer: str = None, painted: bool = False, latest=None):
+        """Start (or queue for) the producer, then stream its data
+
+        Runs as its own task, so the socket's receive loop keeps reading while the request is
+        queued and a disconnect gives up the place in line.
+        """
+        try:
+            await process_manager.start_process(
+                self.process_key, file_name, self.folder, client, self.send_json, producer, owner=self.websocket
+            )
+        except asyncio.CancelledError:
+            # The client left while queued, or the server is draining
+            return
+        try:
+            if self.closed:
+                # Left while the producer was starting: stop it unless someone else uses it
+                await process_manager.stop_process(self.process_key)
+                return
+            await process_manager.add_session(self.process_key, self)
+            if process_manager.is_in_process(self.process_key):
+                # In-process producers publish to the session directly, there is no file to watch
+                if not painted or broadcaster.latest.get(self.process_key) is not latest:
+                    await broadcaster.send_latest(self.process_key, self)
+            else:
+                await self.watch(file_name)
+        except Exception as e:
+            print(f"Error starting session {self.process_key}: {e}")
+
+    async def watch(self, file_name: str):
+        """Send the file now and again whenever the folder watcher sees it change"""
+        if self.closed:
+            return
+        file_path = self.pinned = os.path.join(self.folder, file_name)
+        frame_cache.pin(file_path)
+        await watchers.subscribe(self, self.folder, glob.escape(file_name))
+        if self.closed:
+            # The producer exited (or the client left) during the first scan
+            return
+        current = file_fingerprint(file_path)
+        if self.painted is None:
+            await self.send_file_data(file_path)
+        elif current is not None and current != self.painted["fingerprint"]:
+            # Changed since the first paint; a still-missing file keeps the painted snapshot
+            # on screen until the producer writes one, instead of an empty frame
+            await self.send_file_data(file_path)
+
+    async def send_cached(self, file_path: str) -> bool:
+        """First paint: send the newest version already known, before any producer work
 
-    async def send_file_data(self, file_path: str):
+        In order: an in-process producer's last publish, the file on disk (from the frame
+        cache, a sidecar or a parse), or a snapshot restored from the checkpoint. The data is
+        preceded by a {"type": "cached"} frame with its version, age in seconds and source.
+        """
+        try:
+            if self.process_key in broadcaster.latest:
+                version, published_at = broadcaster.published.get(self.process_key, (None, time.time()))
+                await self.send_json({"type": "cached", "key": self.process_key, "source": "producer",
+                                      "version": version, "age": time.time() - published_at})
+                await broadcaster.send_latest(self.process_key, self)
+                return True
+            fingerprint = file_fingerprint(file_path)
+            snapshot = snapshots.get(file_path)
+            if fingerprint is not None:
+                cached = snapshot and snapshot["fingerprint"] == fingerprint and frame_cache.peek((file_path, fingerprint)) is not None
+                df = await parse_pool.parse(file_path, None)
+                snapshot = snapshots.get(file_path)
+                source, published_at = "cache" if cached else "file", fingerprint[1] / 1e9
+            else:
+                # Nothing on disk yet (e.g. a restart on a clean folder): the restored snapshot is all there is
+                df = snapshots.frame(file_path)
+                source, published_at = "snapshot", snapshot["published_at"] if snapshot else None
+            if df is None or snapshot is None:
+                return False
+            await self.send_json({"type": "cached", "key": self.process_key, "source": source,
+                                  "version": snapshot["version"], "age": time.time() - published_at})
+            if self.wants_frames():
+                await self.send_frame_update(df)
+            else:
+                await self.send_frames(await parse_pool.encode(df, self.output_format))
+            self.painted = {"fingerprint": fingerprint, "version": snapshot["version"], "source": source}
+            return True
+        except Exception as e:
+            print(f"Error sending cached data for {self.process_key}: {e}")
+            return False
+
+    def on_file_event(self, event: str, file_name: str, trace=None):
+        """Called by the folder watcher when the watched file is added, updated or removed"""
+        manager.outbox(self.websocket).post(
+            self.process_key, functools.partial(self.send_file_data, os.path.join(self.folder, file_name), trace)
+        )
+
+    async def send_file_data(self, file_path: str, trace=None):
         """Read file and send data via WebSocket"""
         try:
             print("Sending data")
-            json_data = json.dumps({})
-            if os.path.isfile(file_path):
-                try:
-                    df = pl.read_csv(file_path)
-                    df = df.with_columns([
-                        pl.col(column).apply(lambda x: None if x is None or (isinstance(x, float) and x != x) else x)
-                        for column in df.columns
-                    ])
-                    if df.is_empty():
-                        json_data = json.dumps({})
-                    else:
-                        data = df.to_dict(as_series=False)
-                        json_data = json.dumps(data)
-                except ComputeError:
-                    json_data = json.dumps({})
+            if self.wants_frames():
+                await self.send_frame_update(await parse_pool.parse(file_path, None, trace), trace)
             else:
-                json_data = json.dumps({})
-
-            await self.send_personal_message(json_data)
+                await self.send_frames(await parse_pool.parse(file_path, self.output_format, trace), trace)
         except WebSocketDisconnect:
             print(f"WebSocket disconnect detected for file {file_path}")
         except Exception as e:
             print(f"Error reading file {file_path}: {e}")
 
-    async def send_personal_message(self, message: str):
+    def wants_frames(self) -> bool:
+        """Top-N views and delta streams work on the DataFrame, not on pre-encoded frames"""
+        return self.view is not None or self.output_format == "delta"
+
+    async def send_frame_update(self, df, trace=None):
+        if self.view:
+            await self.send_view(df, trace)
+        else:
+            await self.send_delta(df, trace)
+
+    async def send_delta(self, df, trace=None):
+        """Send only the rows that changed since the version this session last received"""
+        with span(trace, "delta", key=self.process_key):
+            frames = await parse_pool.call(encode_delta, self.previous, df)
+        self.previous = df
+        await self.send_frames(frames, trace)
+
+    async def send_view(self, df, trace=None):
+        """Send the session's top-N window for a new version instead of the whole file"""
+        with span(trace, "topn", key=self.process_key):
+            payload = await parse_pool.call(self.view.update, df)
+        with span(trace, manager.outbox(self.websocket).stage, key=self.process_key):
+            await self.send_json(payload)
+
+    async def send_frames(self, frames: list, trace=None):
+        # ndjson row batches are not single JSON documents and cannot be spliced into a batch
+        batchable = self.output_format != "ndjson"
+        with span(trace, manager.outbox(self.websocket).stage, key=self.process_key, frames=len(frames)):
+            for frame in frames:
+                await self.send_personal_message(frame, batchable)
+
+    async def send_json(self, payload: dict):
+        await self.send_personal_message(json.dumps(payload))
+
+    async def send_personal_message(self, message: str, batchable: bool = True):
         """Send a message via WebSocket"""
         try:
             if self.websocket.client_state == WebSocketState.CONNECTED:
-                await self.websocket.send_text(message)
+                started = time.perf_counter()
+                await manager.outbox(self.websocket).send(message, batchable)
+                self.last_send_latency = time.perf_counter() - started
+                self.bytes_sent += len(message)
+                self.frames_sent += 1
             else:
                 self.disconnect()
         except Exception as e:
             print(f"Exception while sending data: {e}")
             self.disconnect()
 
+    def unwatch(self):
+        """Stop watching for good; a watch still in its first scan sees closed and returns"""
+        self.closed = True
+        watchers.unsubscribe(self, self.folder)
+        if self.pinned:
+            frame_cache.unpin(self.pinned)
+            self.pinned = None
+
+    async def producer_exited(self, returncode: int):
+        """The producer stopped by itself: tell the client and stop watching its file"""
+        self.unwatch()
+        manager.active_connections[self.process_key].discard(self)
+        await self.send_json({"status": "producer_exited", "key": self.process_key, "returncode": returncode})
+
     def disconnect(self):
         """Clean up on disconnect"""
+        self.unwatch()
         asyncio.create_task(process_manager.remove_session(self.process_key, self))
 
 
+class GlobSession(UserSession):
+    """Class to stream every file in a folder matching a glob pattern"""
+
+    def __init__(self, websocket: WebSocket, folder: str, pattern: str, output_format: str = "columns"):
+        super().__init__(websocket, f"glob:{folder}/{pattern}", output_format, folder)
+        self.pattern = pattern
+        # Keeps one file's message and its ndjson batches together when files update at once
+        self.lock = asyncio.Lock()
+
+    async def watch(self, file_name: str = None):
+        """Send every currently matching file, then add/update/remove events as they happen"""
+        for name in await watchers.subscribe(self, self.folder, self.pattern):
+            self.on_file_event("added", name)
+
+    def on_file_event(self, event: str, file_name: str, trace=None):
+        key = f"{self.process_key}:{file_name}"
+        outbox = manager.outbox(self.websocket)
+        pending = outbox.deferred.get(key)
+        if pending is not None and pending.args[0] == "added" and event == "updated":
+            # Not delivered yet: the client still has to learn that the file was added
+            event = "added"
+        outbox.post(key, functools.partial(self.send_file_event, event, file_name, trace))
+
+    async def send_file_event(self, event: str, file_name: str, trace=None):
+        """Send {"type": event, "file": name, "data": <first frame>} as one message, then any ndjson batches"""
+        file_path = os.path.join(self.folder, file_name)
+        frames = []
+        if event != "removed":
+            try:
+                frames = await parse_pool.parse(file_path, self.output_format, trace)
+            except Exception as e:
+                print(f"Error reading file {file_path}: {e}")
+        message = json.dumps({"type": event, "file": file_name})
+        if frames:
+            # The frame is already JSON, so it is spliced in rather than decoded and re-encoded
+            message = message[:-1] + ', "data": ' + frames[0] + "}"
+        async with self.lock:
+            await self.send_frames([message] + frames[1:], trace)
+
+    def disconnect(self):
+        """Clean up on disconnect; glob sessions do not own a producer"""
+        self.closed = True
+        watchers.unsubscribe(self, self.folder)
+
+
+class ReplaySession(UserSession):
+    """Class to play a recorded key back from a point in time at a speed multiplier"""
+
+    def __init__(self, websocket: WebSocket, key: str, start: float = None, speed: float = 1.0):
+        super().__init__(websocket, f"replay:{key}")
+        self.key = key
+        self.start = start
+        self.speed = speed
+        self.task = None
+
+    async def watch(self, file_name: str = None):
+        self.task = asyncio.create_task(self.play())
+
+    async def play(self):
+        paths = recorder.paths(self.key) if recorder else None
+        if paths is None:
+            await self.send_json({"type": "replay", "key": self.key, "error": "No recording"})
+            return
+        log_path, index_path = paths
+        index = VersionIndex(index_path)
+        position = index.find_time(self.start) if self.start else 0
+        df = None
+        previous_time = None
+        with open(log_path, "rb") as log:
+            # Seek to the keyframe at or before the start and rebuild state up to it silently
+            log.seek(index[index.keyframe_before(position)][2])
+            for entry_position in range(index.keyframe_before(position), len(index)):
+                record = json.loads(log.readline())
+                df = apply_delta(df, record)
+                if entry_position < position:
+                    continue
+                if previous_time is not None:
+                    await asyncio.sleep(max(record["t"] - previous_time, 0) / self.speed)
+                previous_time = record["t"]
+                await self.send_json({
+                    "type": "replay", "key": self.key, "version": record["v"], "time": record["t"],
+                    "data": df.to_dict(as_series=False) if df is not None else {},
+                })
+        await self.send_json({"type": "replay", "key": self.key, "done": True})
+
+    def disconnect(self):
+        """Clean up on disconnect; replays do not own a producer"""
+        if self.task:
+            self.task.cancel()
+
+
+class ResourceSampler:
+    """Class to periodically snapshot producer /proc usage and per-session counters for the admin endpoint"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.cpu_times = {}
+        self.snapshot = {"sampled_at": None, "producers": {}, "sessions": []}
+
+    async def run(self):
+        while True:
+            try:
+                producers = await asyncio.to_thread(self.sample_producers, dict(process_manager.processes))
+                self.snapshot = {
+                    "sampled_at": time.time(),
+                    "producers": producers,
+                    "sessions": self.sample_sessions(),
+                }
+            except Exception as e:
+                print(f"Error sampling resource usage: {e}")
+            await asyncio.sleep(self.interval)
+
+    def sample_producers(self, processes: dict) -> dict:
+        now = time.monotonic()
+        usage = {}
+        for process_key, entry in processes.items():
+            pid = entry["process"].pid
+            if pid is None:
+                # In-process producers share the server's own CPU and memory
+                usage[process_key] = {"mode": "inprocess", "alive": entry["process"].returncode is None}
+                usage[process_key]["age"] = time.time() - entry["started"]
+                usage[process_key]["sessions"] = len(entry["sessions"])
+                continue
+            try:
+                usage[process_key] = self.read_proc(pid, now)
+            except (FileNotFoundError, ProcessLookupError):
+                usage[process_key] = {"pid": pid, "alive": False}
+                continue
+            usage[process_key]["age"] = time.time() - entry["started"]
+            usage[process_key]["sessions"] = len(entry["sessions"])
+        live_pids = {entry["process"].pid for entry in processes.values()}
+        self.cpu_times = {pid: sample for pid, sample in self.cpu_times.items() if pid in live_pids}
+        return usage
+
+    def read_proc(self, pid: int, now: float) -> dict:
+        """CPU%, RSS and open fds for one pid from /proc"""
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, so split after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_ticks = int(fields[11]) + int(fields[12])
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        previous = self.cpu_times.get(pid)
+        self.cpu_times[pid] = (cpu_ticks, now)
+        cpu_percent = None
+        if previous and now > previous[1]:
+            cpu_percent = 100 * (cpu_ticks - previous[0]) / os.sysconf("SC_CLK_TCK") / (now - previous[1])
+        return {
+            "pid": pid,
+            "alive": fields[0] != "Z",
+            "cpu_percent": cpu_percent,
+            "rss_bytes": rss,
+            "open_fds": len(os.listdir(f"/proc/{pid}/fd")),
+        }
+
+    def sample_sessions(self) -> list:
+        subscriptions = defaultdict(int)
+        sessions = [session for group in manager.active_connections.values() for session in group]
+        for session in sessions:
+            subscriptions[session.websocket] += 1
+        return [
+            {
+                "key": session.process_key,
+                "client": f"{session.websocket.client.host}:{session.websocket.client.port}" if session.websocket.client else None,
+                "connected_for": time.time() - session.connected_at,
+                "bytes_sent": session.bytes_sent,
+                "frames_sent": session.frames_sent,
+                "subscriptions": subscriptions[session.websocket],
+                "last_send_latency": session.last_send_latency,
+                "client_metrics": manager.client_metrics.get(session.websocket),
+                "quota": manager.outbox(session.websocket).quota.metrics(),
+            }
+            for session in sessions
+        ]
+
+
+class Checkpointer:
+    """Class to persist the active producers and latest snapshots across server restarts"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def snapshot_file(self, key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()[:16] + ".parquet"
+
+    async def save(self):
+        if not self.directory:
+            return
+        state = {
+            "saved_at": time.time(),
+            "producers": [
+                {"key": key, "file_name": entry["file_name"], "file_folder": entry["file_folder"], "producer": entry["producer"]}
+                for key, entry in process_manager.processes.items()
+            ],
+        }
+        files = {
+            ("file", path): dict(snapshot, df=snapshots.frame(path))
+            for path, snapshot in snapshots.snapshots.items() if snapshots.frame(path) is not None
+        }
+        files.update({
+            ("producer", key): {"df": df, "fingerprint": None, "published_at": broadcaster.published.get(key, (None, time.time()))[1]}
+            for key, df in broadcaster.latest.items() if df is not None
+        })
+        try:
+            await asyncio.to_thread(self.write, state, files)
+            print(f"Checkpointed {len(state['producers'])} producers and {len(files)} snapshots to {self.directory}")
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
+
+    def write(self, state: dict, files: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        state["snapshots"] = []
+        for (kind, key), snapshot in files.items():
+            file_name = self.snapshot_file(f"{kind}:{key}")
+            snapshot["df"].write_parquet(os.path.join(self.directory, file_name))
+            state["snapshots"].append({
+                "kind": kind, "key": key, "file": file_name,
+                "fingerprint": snapshot["fingerprint"], "published_at": snapshot["published_at"],
+            })
+        state_path = os.path.join(self.directory, "state.json")
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+        referenced = {entry["file"] for entry in state["snapshots"]}
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet") and name not in referenced:
+                os.remove(os.path.join(self.directory, name))
+
+    async def restore(self):
+        state_path = os.path.join(self.directory, "state.json") if self.directory else None
+        if not state_path or not os.path.isfile(state_path):
+            return
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            loaded = await asyncio.to_thread(self.read_snapshots, state["snapshots"])
+        except Exception as e:
+            print(f"Error reading checkpoint: {e}")
+            return
+        for entry, df in loaded:
+            if entry["kind"] == "file":
+                fingerprint = tuple(entry["fingerprint"]) if entry["fingerprint"] else None
+                snapshots.put(entry["key"], fingerprint, df, entry["published_at"])
+            else:
+                broadcaster.latest[entry["key"]] = df
+                broadcaster.published[entry["key"]] = (None, entry["published_at"])
+        for producer in state["producers"]:
+            if producer["producer"] and producers.get(producer["producer"]) is None:
+                print(f"Not restoring {producer['key']}: producer plugin {producer['producer']} is not registered")
+                continue
+            await process_manager.start_process(
+                producer["key"], producer["file_name"], producer["file_folder"], producer=producer["producer"],
+                bypass_queue=True
+            )
+            asyncio.create_task(self.stop_if_unused(producer["key"]))
+        print(f"Restored {len(state['producers'])} producers and {len(loaded)} snapshots from {self.directory}")
+
+    def read_snapshots(self, entries: list) -> list:
+        loaded = []
+        for entry in entries:
+            path = os.path.join(self.directory, entry["file"])
+            if os.path.isfile(path):
+                loaded.append((entry, pl.read_parquet(path)))
+        return loaded
+
+    async def stop_if_unused(self, process_key: str):
+        await asyncio.sleep(RESTORE_GRACE)
+        await process_manager.stop_process(process_key)
+
+
 class ConnectionManager:
     """Class defining socket events"""
 
     def __init__(self):
         self.active_connections = defaultdict(set)
+        self.client_metrics = {}
+        self.outboxes = {}
+        self.user_quotas = {}
+        self.session_starts = set()
+        self.draining = False
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
+        user = websocket.client.host if websocket.client else None
+        user_quota = self.user_quotas.setdefault(user, Quota(USER_BYTES_PER_SEC, USER_FRAMES_PER_SEC))
+        self.outboxes[websocket] = Outbox(
+            websocket, BATCH_WINDOW, Quota(CLIENT_BYTES_PER_SEC, CLIENT_FRAMES_PER_SEC), user_quota
+        )
+
+    def outbox(self, websocket: WebSocket) -> Outbox:
+        """The socket's outbox; sends go straight out once the socket is gone"""
+        return self.outboxes.get(websocket) or Outbox(websocket)
+
+    def start(self, coroutine):
+        """Run a session start in the background, keeping a reference until it is done"""
+        task = asyncio.create_task(coroutine)
+        self.session_starts.add(task)
+        task.add_done_callback(self.session_starts.discard)
+
+    def websockets(self) -> set:
+        return {session.websocket for sessions in self.active_connections.values() for session in sessions}
+
+    def get_session(self, websocket: WebSocket, key: str):
+        """Return the session already streaming key to this socket, if any"""
+        for session in self.active_connections.get(key, ()):
+            if session.websocket == websocket:
+                return session
+        return None
 
     async def disconnect(self, websocket: WebSocket):
+        self.client_metrics.pop(websocket, None)
+        process_manager.cancel_waiters(websocket)
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox:
+            outbox.close()
+            user = websocket.client.host if websocket.client else None
+            if not any(other.user_quota is outbox.user_quota for other in self.outboxes.values()):
+                self.user_quotas.pop(user, None)
         for process_key, sessions in self.active_connections.items():
             for session in sessions:
                 if session.websocket == websocket:
@@ -120,6 +2354,22 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 process_manager = ProcessManager()
+watchers = WatcherRegistry()
+producers = ProducerRegistry(PRODUCER_ENTRY_POINT_GROUP)
+broadcaster = Broadcaster()
+snapshots = SnapshotStore()
+frame_cache = FrameCache(FRAME_CACHE_BYTES)
+row_indexes = RowIndexStore(TAIL_FILES)
+sidecars = SidecarCache(SIDECAR_DIR, SIDECAR_MAX_AGE, SIDECAR_BUDGET) if SIDECAR_DIR else None
+checkpointer = Checkpointer(CHECKPOINT_DIR)
+recorder = VersionRecorder(RECORD_DIR) if RECORD_DIR else None
+tracer = Tracer(TRACE_SAMPLE_RATE, TRACE_FILE)
+profiler = StackProfiler()
+resource_sampler = ResourceSampler(STATS_INTERVAL)
+parse_pool = ParsePool(PARSE_POOL_SIZE)
+
+RECONNECT_FRAME = json.dumps({"control": "reconnect-elsewhere"})
+
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -129,36 +2379,183 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             message = await websocket.receive_text()
             file_info = json.loads(message)
+            if file_info.get("type") == "client_metrics":
+                # Apply/render timings reported by the bundled page, shown in /admin/stats
+                manager.client_metrics[websocket] = {
+                    **{name: file_info.get(name) for name in ("frames", "apply_ms", "render_ms", "renders", "rows")},
+                    "reported_at": time.time(),
+                }
+                continue
+            if manager.draining:
+                await websocket.send_text(RECONNECT_FRAME)
+                continue
             req_from_id = file_info.get("req_from_id")
             req_to_id = file_info.get("req_to_id")
             offset = file_info.get("offset", 5)
+            output_format = file_info.get("format", "columns")
+            pattern = file_info.get("pattern")
+            producer = file_info.get("producer")
+            sort_by = file_info.get("sort_by")
+            top_n = file_info.get("top_n")
             process_key = f"{req_from_id}-{req_to_id}"
 
+            batch_ms = file_info.get("batch_ms")
+            if batch_ms is not None:
+                if not isinstance(batch_ms, (int, float)) or batch_ms < 0:
+                    await websocket.send_text(json.dumps({"error": "batch_ms must be a non-negative number"}))
+                    continue
+                manager.outbox(websocket).window = min(batch_ms / 1000, MAX_BATCH_WINDOW)
+                if not (req_from_id or req_to_id or pattern or file_info.get("replay")):
+                    # Only a batching change for the connection, no subscription
+                    continue
+
+            if output_format not in OUTPUT_FORMATS:
+                await websocket.send_text(json.dumps({"error": f"Unknown format {output_format}, expected one of {OUTPUT_FORMATS}"}))
+                continue
+
+            if file_info.get("replay"):
+                # Playback of a recorded key; no producer is started
+                speed = file_info.get("speed", 1.0)
+                if not isinstance(speed, (int, float)) or not math.isfinite(speed) or speed <= 0:
+                    await websocket.send_text(json.dumps({"error": "speed must be a positive number"}))
+                    continue
+                replay_session = ReplaySession(websocket, file_info["replay"], file_info.get("from"), float(speed))
+                manager.active_connections[replay_session.process_key].add(replay_session)
+                await replay_session.watch()
+                continue
+
+            if pattern:
+                if output_format == "delta":
+                    await websocket.send_text(json.dumps({"error": "The delta format is not available for pattern subscriptions"}))
+                    continue
+                # Folder subscription: stream every matching file, no producer is started
+                folder = resolve_folder(file_info.get("folder", FILE_FOLDER))
+                if folder is None or not is_plain_name(pattern):
+                    await websocket.send_text(json.dumps({"error": f"Folder and pattern must stay inside {FILE_FOLDER}"}))
+                    continue
+                glob_session = GlobSession(websocket, folder, pattern, output_format)
+                if manager.get_session(websocket, glob_session.process_key) is None:
+                    manager.active_connections[glob_session.process_key].add(glob_session)
+                    await glob_session.watch()
+                continue
+
             if not req_from_id or not req_to_id:
                 print("Missing req_from_id or req_to_id in received data")
                 await websocket.send_text(json.dumps({"error": "Missing req_from_id or req_to_id in received data"}))
                 continue
 
+            if not is_plain_name(f"{req_from_id}-{req_to_id}"):
+                await websocket.send_text(json.dumps({"error": "req_from_id and req_to_id must not contain paths"}))
+                continue
+
+            if (sort_by is None) != (top_n is None) or (top_n is not None and (not isinstance(top_n, int) or top_n <= 0)):
+                await websocket.send_text(json.dumps({"error": "sort_by and top_n must be given together, top_n a positive integer"}))
+                continue
+            view = TopNView(sort_by, top_n, file_info.get("descending", True), file_info.get("key")) if top_n else None
+
+            if producer and producers.get(producer) is None:
+                await websocket.send_text(json.dumps({"error": f"Unknown producer {producer}"}))
+                continue
+
             file_name = f"{req_from_id}-{req_to_id}.csv"
-            file_path = os.path.join("path_to_your_files", file_name)  # Replace "path_to_your_files" with the actual path
+            file_path = os.path.join(FILE_FOLDER, file_name)
 
-            user_session = UserSession(websocket, process_key)
+            user_session = manager.get_session(websocket, process_key)
+            if user_session is not None:
+                # Already streaming this file to the socket: a repeat request just refreshes it
+                user_session.output_format = output_format
+                user_session.view = view
+                user_session.previous = None
+                if process_manager.is_in_process(process_key):
+                    await broadcaster.send_latest(process_key, user_session)
+                else:
+                    await user_session.send_file_data(file_path)
+                continue
+
+            user_session = UserSession(websocket, process_key, output_format)
+            user_session.view = view
             manager.active_connections[process_key].add(user_session)
+            # Paint whatever version is already known before waiting on the producer
+            painted = await user_session.send_cached(file_path)
+            latest = broadcaster.latest.get(process_key)
 
-            await process_manager.start_process(process_key, file_name, "path_to_your_files")
-            await process_manager.add_session(process_key, user_session)
-            await user_session.send_file_data(file_path)
+            client = websocket.client.host if websocket.client else None
+            manager.start(user_session.start(file_name, client, producer, painted, latest))
     except WebSocketDisconnect:
         print("WebSocket disconnect detected")
     finally:
         await manager.disconnect(websocket)
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "parse_pool": parse_pool.metrics(),
+        "producers": process_manager.metrics(),
+        "snapshots": {"files": len(snapshots.snapshots), "torn_reads": snapshots.torn_reads},
+        "frame_cache": frame_cache.metrics(),
+        "row_index": row_indexes.metrics(),
+        "sidecars": sidecars.metrics() if sidecars else None,
+        "quotas": {
+            "throttled_connections": sum(1 for outbox in manager.outboxes.values() if outbox.deferred),
+            "coalesced": sum(outbox.quota.coalesced for outbox in manager.outboxes.values()),
+            "users": {user: quota.metrics() for user, quota in manager.user_quotas.items()},
+        },
+        "batching": {
+            "connections": sum(1 for outbox in manager.outboxes.values() if outbox.window),
+            "batches": sum(outbox.batches_sent for outbox in manager.outboxes.values()),
+            "frames_batched": sum(outbox.frames_batched for outbox in manager.outboxes.values()),
+        },
+    }
+
+async def require_admin(request: Request, authorization: str = Header(None)):
+    """Check the bearer token on /admin routes, or allow only local clients when no token is configured"""
+    if not ADMIN_TOKEN:
+        if not request.client or request.client.host not in LOCAL_HOSTS:
+            raise HTTPException(status_code=403, detail="Set ADMIN_TOKEN to use /admin from other hosts")
+    elif not secrets.compare_digest(authorization or "", f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def admin_stats():
+    return resource_sampler.snapshot
+
+@app.get("/admin/logs/{process_key}", dependencies=[Depends(require_admin)])
+async def admin_logs(process_key: str, lines: int = 200):
+    log = process_manager.logs.get(process_key)
+    if log is None:
+        return JSONResponse({"error": f"No output captured for {process_key}"}, status_code=404)
+    return {"key": process_key, "running": process_key in process_manager.processes, "lines": log.tail(lines)}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(seconds: float = 10, interval: float = 0.01, memory_top: int = 0):
+    """Sample all threads for a few seconds and return collapsed stacks (plus top allocations)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Set ADMIN_TOKEN to enable profiling")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    result = await asyncio.to_thread(profiler.run, seconds, max(interval, 0.001), memory_top)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if memory_top:
+        return result
+    return PlainTextResponse(
+        result["collapsed"],
+        headers={"Content-Disposition": f"attachment; filename=profile-{int(time.time())}.folded"},
+    )
+
 @app.get("/")
 async def get():
     return HTMLResponse("""
     <html>
         <head>
             <title>WebSocket File Streaming</title>
+            <style>
+                #viewport { height: 600px; overflow: auto; position: relative; border: 1px solid #ccc; }
+                #spacer { position: relative; }
+                table { table-layout: fixed; width: 100%; border-collapse: collapse; font-family: monospace; }
+                #rows { position: absolute; top: 0; left: 0; }
+                th, td { height: 24px; padding: 0 4px; text-align: left; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+                th { background: #eee; }
+            </style>
         </head>
         <body>
             <h1>WebSocket File Streaming</h1>
@@ -166,9 +2563,21 @@ async def get():
             <input type="text" id="req_to_id" placeholder="Enter req_to_id" />
             <input type="number" id="offset" placeholder="Enter offset (default 5)" />
             <button onclick="connectWebSocket()">Connect</button>
-            <pre id="output"></pre>
+            <p><span id="status"></span> <span id="count"></span></p>
+            <table><thead><tr id="header"></tr></thead></table>
+            <div id="viewport">
+                <div id="spacer"><table id="rows"></table></div>
+            </div>
             <script>
+                // Rows live in memory and are patched by "delta" frames; only the rows in view
+                // (plus a little overscan) are ever in the DOM.
+                var ROW_HEIGHT = 24;
+                var OVERSCAN = 10;
+                var METRICS_INTERVAL = 2000;
                 var ws;
+                var table = {columns: [], key: null, rows: [], index: new Map()};
+                var timings = {frames: 0, apply: 0, renders: 0, render: 0};
+                var renderPending = false;
 
                 function connectWebSocket() {
                     var req_from_id = document.getElementById("req_from_id").value;
@@ -176,26 +2585,145 @@ async def get():
                     var offset = document.getElementById("offset").value || 5;
 
                     if (ws) {
+                        ws.onclose = null;
                         ws.close();
                     }
-                    ws = new WebSocket(`ws://127.0.0.1:8000/ws`);
+                    ws = new WebSocket(`${location.protocol === "https:" ? "wss" : "ws"}://${location.host}/ws`);
 
                     ws.onopen = function(event) {
-                        ws.send(JSON.stringify({req_from_id: req_from_id, req_to_id: req_to_id, offset: offset}));
+                        setStatus("Connected");
+                        ws.send(JSON.stringify({req_from_id: req_from_id, req_to_id: req_to_id, offset: offset, format: "delta"}));
                     };
 
                     ws.onmessage = function(event) {
+                        var message;
                         try {
-                            document.getElementById("output").textContent = JSON.stringify(JSON.parse(event.data), null, 2);
+                            message = JSON.parse(event.data);
                         } catch (e) {
                             console.error("Invalid JSON received", e);
+                            return;
                         }
+                        (message.type === "batch" ? message.frames : [message]).forEach(handleMessage);
                     };
 
                     ws.onclose = function(event) {
-                        alert("WebSocket connection closed");
+                        setStatus("WebSocket connection closed");
                     };
                 }
+
+                function handleMessage(message) {
+                    var started = performance.now();
+                    if (message.type === "snapshot") {
+                        loadSnapshot(message);
+                    } else if (message.type === "delta") {
+                        applyDelta(message);
+                    } else if (message.control === "reconnect-elsewhere") {
+                        setStatus("Server is restarting, reconnecting");
+                        setTimeout(connectWebSocket, 1000);
+                        return;
+                    } else {
+                        setStatus(JSON.stringify(message));
+                        return;
+                    }
+                    timings.frames += 1;
+                    timings.apply += performance.now() - started;
+                    scheduleRender();
+                }
+
+                function setStatus(text) {
+                    document.getElementById("status").textContent = text;
+                }
+
+                function loadSnapshot(message) {
+                    table.columns = message.columns;
+                    table.key = message.key;
+                    table.rows = message.rows;
+                    reindex();
+                    document.getElementById("header").innerHTML = table.columns.map(function(column) {
+                        return "<th>" + escapeHtml(column) + "</th>";
+                    }).join("");
+                }
+
+                function reindex() {
+                    var position = table.columns.indexOf(table.key);
+                    table.index = new Map();
+                    table.rows.forEach(function(row, i) {
+                        table.index.set(row[position], i);
+                    });
+                }
+
+                function applyDelta(message) {
+                    var position = table.columns.indexOf(message.key);
+                    if (message.deletes.length) {
+                        var deleted = new Set(message.deletes);
+                        table.rows = table.rows.filter(function(row) {
+                            return !deleted.has(row[position]);
+                        });
+                        reindex();
+                    }
+                    message.upserts.forEach(function(record) {
+                        var row = table.columns.map(function(column) { return record[column]; });
+                        var i = table.index.get(row[position]);
+                        if (i === undefined) {
+                            table.index.set(row[position], table.rows.length);
+                            table.rows.push(row);
+                        } else {
+                            table.rows[i] = row;
+                        }
+                    });
+                }
+
+                function scheduleRender() {
+                    if (!renderPending) {
+                        renderPending = true;
+                        requestAnimationFrame(render);
+                    }
+                }
+
+                function render() {
+                    renderPending = false;
+                    var started = performance.now();
+                    var viewport = document.getElementById("viewport");
+                    var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+                    var last = Math.min(table.rows.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+                    var html = [];
+                    for (var i = first; i < last; i++) {
+                        html.push("<tr>" + table.rows[i].map(function(value) {
+                            return "<td>" + (value === null ? "" : escapeHtml(String(value))) + "</td>";
+                        }).join("") + "</tr>");
+                    }
+                    var rows = document.getElementById("rows");
+                    document.getElementById("spacer").style.height = (table.rows.length * ROW_HEIGHT) + "px";
+                    rows.style.transform = `translateY(${first * ROW_HEIGHT}px)`;
+                    rows.innerHTML = html.join("");
+                    document.getElementById("count").textContent = `${table.rows.length} rows`;
+                    timings.renders += 1;
+                    timings.render += performance.now() - started;
+                }
+
+                function escapeHtml(text) {
+                    return text.replace(/[&<>"]/g, function(c) {
+                        return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c];
+                    });
+                }
+
+                function reportMetrics() {
+                    if (!ws || ws.readyState !== WebSocket.OPEN || !timings.frames) {
+                        return;
+                    }
+                    ws.send(JSON.stringify({
+                        type: "client_metrics",
+                        frames: timings.frames,
+                        apply_ms: timings.apply / timings.frames,
+                        renders: timings.renders,
+                        render_ms: timings.renders ? timings.render / timings.renders : null,
+                        rows: table.rows.length,
+                    }));
+                    timings = {frames: 0, apply: 0, renders: 0, render: 0};
+                }
+
+                document.getElementById("viewport").addEventListener("scroll", scheduleRender);
+                setInterval(reportMetrics, METRICS_INTERVAL);
             </script>
         </body>
     </html>
@@ -203,4 +2731,19 @@ async def get():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+
+    class DrainingServer(uvicorn.Server):
+        """uvicorn server that drains sessions and producers before it closes the sockets"""
+
+        async def shutdown(self, sockets=None):
+            await drain_server()
+            await super().shutdown(sockets=sockets)
+
+    options = runtime_options(RUNTIME_PROFILE)
+    if options.get("workers", 1) > 1:
+        # Worker processes import the app by name and run uvicorn's own Server, so they
+        # drain from the lifespan hook after uvicorn has closed the sockets
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        uvicorn.run(f"{module}:app", host=SERVER_HOST, port=SERVER_PORT, **options)
+    else:
+        DrainingServer(uvicorn.Config(app, host=SERVER_HOST, port=SERVER_PORT, **options)).run()